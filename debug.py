@@ -15,7 +15,7 @@ def reduce_array_ext(expr):
         e2 = z3.And(nsubs)
         print subs[i].sexpr(),
         for rep in range(100):
-            check = simsym.check(e2)
+            check = simsym.check(e2, need_model=True)
             if check.is_unknown:
                 continue
             if 'array-ext' in check.z3_model.sexpr():
@@ -1,6 +1,6 @@
-__all__ = ['Graph']
+__all__ = ['Graph', 'GraphWriter']
 
-import sys, subprocess, tempfile, collections
+import sys, subprocess, tempfile, collections, json
 
 def dot_val(obj):
     if isinstance(obj, (int, float, bool)):
@@ -107,3 +107,81 @@ class Graph(object):
 
     def obj_attrs(self, obj):
         return {'label': unicode(obj)}
+
+class GraphWriter(object):
+    """Write a series of graphs to a file as they are built.
+
+    Unlike Graph, a GraphWriter doesn't keep nodes or edges in memory,
+    so it's up to the caller not to add duplicates.  fmt is "dot" to
+    write one digraph per graph, or "jsonl" to write one JSON object
+    per line: a {"graph": N} record starts each graph, and is followed
+    by {"node": ID, ...attrs} and {"edge": [ID1, ID2], ...attrs}
+    records, where node IDs are local to the graph.
+
+    If resume is not None, it is a value returned by output_state,
+    and fp must be positioned at the end of the output it describes.
+    The writer then continues that output.
+    """
+
+    def __init__(self, fp, fmt="dot", resume=None):
+        if fmt not in ("dot", "jsonl"):
+            raise ValueError("Unknown graph format %r" % fmt)
+        self.__fp, self.__fmt = fp, fmt
+        self.__ngraphs = 0
+        self.__nnodes = None
+        if resume is not None:
+            self.__ngraphs, self.__nnodes = resume['graphs'], resume['nodes']
+
+    def output_state(self):
+        """Return the state of the output written so far.
+
+        size is the length of the output, graphs is the number of
+        graphs begun, and nodes is the number of nodes in the current
+        graph, or None if no graph is open.
+        """
+
+        self.__fp.flush()
+        return {'size': self.__fp.tell(), 'graphs': self.__ngraphs,
+                'nodes': self.__nnodes}
+
+    def begin(self, **node_attrs):
+        """Start a new graph with default node attributes node_attrs."""
+        self.end()
+        if self.__fmt == "dot":
+            print >>self.__fp, 'digraph G%d {' % self.__ngraphs
+            if node_attrs:
+                print >>self.__fp, 'node %s;' % dot_attrs(node_attrs)
+        else:
+            self.__json(graph=self.__ngraphs, node_attrs=node_attrs)
+        self.__ngraphs += 1
+        self.__nnodes = 0
+
+    def end(self):
+        """End the current graph, if any, and flush the output."""
+        if self.__nnodes is None:
+            return
+        if self.__fmt == "dot":
+            print >>self.__fp, '}'
+        self.__nnodes = None
+        self.__fp.flush()
+
+    def node(self, **attrs):
+        """Add a node to the current graph and return its ID."""
+        nid = 'n%d' % self.__nnodes
+        self.__nnodes += 1
+        if self.__fmt == "dot":
+            print >>self.__fp, '%s %s;' % (nid, dot_attrs(attrs))
+        else:
+            self.__json(node=nid, **attrs)
+        return nid
+
+    def edge(self, n1, n2, **attrs):
+        """Add an edge between node IDs n1 and n2 to the current graph."""
+        if self.__fmt == "dot":
+            print >>self.__fp, '%s -> %s %s;' % (n1, n2, dot_attrs(attrs))
+        else:
+            self.__json(edge=[n1, n2], **attrs)
+
+    def __json(self, **obj):
+        print >>self.__fp, json.dumps(
+            {k: v for k, v in obj.items() if v is not None})
@@ -194,7 +194,7 @@ class FsState(object):
       #  prove(simsym.implies(self.constraint,
       #                       simsym.exists(ofdnums, simsym.symand(conds))))
 
-      result = simsym.check(simsym.symand([self.constraint] + conds))
+      result = simsym.check_sliced([self.constraint], conds)
       if result.is_unknown:
         print 'Warning: Unable to check pipe FD existence:', result.reason
       elif result.is_sat:
@@ -531,17 +531,39 @@ class FsState(object):
       'return xerrno(r);')
 
 class FsTestGenerator(testgen.TestGenerator):
-  def __init__(self, test_file_name):
-    super(FsTestGenerator, self).__init__(test_file_name)
-    self.emit = testgen.CodeWriter(open(test_file_name, 'w'))
+  def __init__(self, test_file_name, resume=None):
+    super(FsTestGenerator, self).__init__(test_file_name, resume)
     self.fstests = []
     self.__funcs = {}
     self.__pending_funcs = {}
+    # [ret, body, fname] of each entry of __funcs, in the order they
+    # were added
+    self.__func_log = []
+    # The number of fstests and __func_log entries already returned by
+    # output_state(new_only=True)
+    self.__saved_tests = self.__saved_funcs = 0
 
     # Get some constants from fs
     global DATAVAL_BYTES
     DATAVAL_BYTES = fs_module.DATAVAL_BYTES
 
+    if resume is not None:
+      # Drop anything written after the checkpoint
+      self.__test_file = open(test_file_name, 'r+')
+      self.__test_file.truncate(resume['test_file_size'])
+      self.__test_file.seek(0, 2)
+      self.emit = testgen.CodeWriter(self.__test_file)
+      self.fstests = resume['fstests']
+      self.__func_log = resume['funcs']
+      self.__funcs = {(ret, body): fname
+                      for ret, body, fname in self.__func_log}
+      self.__saved_tests = len(self.fstests)
+      self.__saved_funcs = len(self.__func_log)
+      return
+
+    self.__test_file = open(test_file_name, 'w')
+    self.emit = testgen.CodeWriter(self.__test_file)
+
     self.emit("""\
 //+++ common
 #define _GNU_SOURCE 1
@@ -595,6 +617,16 @@ init_map_file(uintptr_t va, bool writable, const char *fname, off_t offset)
 
     self.emit("//+++ tests")
 
+  def output_state(self, new_only=False):
+    fstests, funcs = self.fstests, self.__func_log
+    if new_only:
+      fstests = fstests[self.__saved_tests:]
+      funcs = funcs[self.__saved_funcs:]
+      self.__saved_tests = len(self.fstests)
+      self.__saved_funcs = len(self.__func_log)
+    return {'test_file_size': self.__test_file.tell(),
+            'fstests': fstests, 'funcs': funcs}
+
   def begin_path(self, result):
     super(FsTestGenerator, self).begin_path(result)
     self.sar = result
@@ -653,6 +685,8 @@ init_map_file(uintptr_t va, bool writable, const char *fname, off_t offset)
 
     # Commit to this code
     self.__funcs.update(self.__pending_funcs)
+    self.__func_log.extend([ret, body, fname] for (ret, body), fname
+                           in self.__pending_funcs.iteritems())
     self.emit(emit)
 
     strargs = {'testid' : testid,
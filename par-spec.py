@@ -9,6 +9,7 @@ import collections
 import traceback
 import sys
 import importlib
+import os
 
 def wrapped_main(*args):
     # Blarg!  multiprocessing eats tracebacks
@@ -21,6 +22,9 @@ def wrapped_main(*args):
         raise Exception(msg)
 
 args = spec.parser.parse_args()
+if args.path_workers:
+    # Pool workers are daemonic, so they can't start path workers
+    spec.parser.error("--path-workers is not supported by par-spec")
 callsets = spec.parse_functions(
     args.functions, args.ncomb, importlib.import_module(args.module))
 pool = multiprocessing.Pool()
@@ -35,6 +39,12 @@ for i, callset in enumerate(callsets):
         csargs.trace_file += suffix
     if csargs.test_file:
         csargs.test_file += suffix
+    if csargs.checkpoint:
+        csargs.checkpoint += suffix
+    if csargs.sched_graph:
+        # Keep the extension, which determines the graph format
+        root, ext = os.path.splitext(csargs.sched_graph)
+        csargs.sched_graph = root + suffix + ext
     csargs.functions = "/".join(callset)
     asyncs.append(pool.apply_async(wrapped_main, [csargs]))
     subargs.append(csargs)
@@ -47,10 +57,15 @@ pool.join()
 print "Model execution complete"
 
 def merge_model_files(ins, out):
-    data = {"tests": collections.OrderedDict()}
+    data = {"tests": collections.OrderedDict(),
+            "peak_rss": collections.OrderedDict()}
     for inpath in ins:
         d = json.load(file(inpath), object_pairs_hook=collections.OrderedDict)
         data["tests"].update(d["tests"])
+        data["peak_rss"].update(d.get("peak_rss", {}))
+        if "peak_rss_error" in d:
+            data.setdefault("peak_rss_error", collections.OrderedDict()) \
+                .update(d["peak_rss_error"])
     json.dump(data, file(out, "w"), indent=2)
 
 def merge_trace_files(ins, out):
@@ -58,6 +73,24 @@ def merge_trace_files(ins, out):
     for inpath in ins:
         outf.write(file(inpath).read())
 
+def merge_graph_files(ins, out):
+    # Each worker numbers its graphs from 0, so renumber them
+    jsonl = out.endswith(".jsonl")
+    outf = file(out, "w")
+    ngraphs = 0
+    for inpath in ins:
+        for line in file(inpath):
+            if jsonl:
+                obj = json.loads(line)
+                if "graph" in obj:
+                    obj["graph"] = ngraphs
+                    ngraphs += 1
+                    line = json.dumps(obj) + "\n"
+            elif re.match(r"digraph G\d+ {$", line):
+                line = "digraph G%d {\n" % ngraphs
+                ngraphs += 1
+            outf.write(line)
+
 def merge_test_files(ins, out):
     merged = None
     for inpath in ins:
@@ -95,6 +128,11 @@ if args.trace_file:
     print "Merging trace files..."
     merge_trace_files([subarg.trace_file for subarg in subargs], args.trace_file)
 
+if args.sched_graph:
+    print "Merging execution graph files..."
+    merge_graph_files([subarg.sched_graph for subarg in subargs],
+                      args.sched_graph)
+
 if args.test_file:
     print "Merging test files..."
     merge_test_files([subarg.test_file for subarg in subargs], args.test_file)
@@ -6,7 +6,17 @@ import z3
 import types
 import collections
 import inspect
-import graph
+import multiprocessing
+import multiprocessing.queues
+import Queue
+import atexit
+import heapq
+import traceback
+import random
+import time
+import copy_reg
+import itertools
+import errno
 
 class options(object):
     # If set, equality tests eagerly simplify expressions that are
@@ -17,6 +27,130 @@ class options(object):
     # when tracing symbolic execution.
     eq_eliminate_structural = True
 
+    # Path exploration engine.  "replay" starts every code path with a
+    # fresh solver and re-asserts (and re-checks) every constraint in
+    # the path's schedule prefix.  "incremental" keeps one solver per
+    # symbolic_apply and walks the schedule tree depth-first using
+    # solver scopes, so the constraints of a schedule prefix shared
+    # with the previous code path are asserted and checked only once.
+    # Both engines re-run the model code of every code path from the
+    # root; "incremental" does not resume paths from a continuation.
+    explore = "replay"
+
+    # If set, a verdictcache.VerdictCache that persists the results of
+    # solver queries across runs.
+    verdict_cache = None
+
+    # If set, each symbolic_apply keeps a CexCache that answers branch
+    # checks by subsumption against earlier checks.
+    cex_cache = False
+
+    # The most unsat sets a CexCache keeps for each query literal, and
+    # the most sat sets it keeps for each constraint.  Older sets are
+    # forgotten, which bounds the cost of a lookup.
+    cex_cache_entries = 64
+
+    # How SchedNodes record where they were created.  "lazy" records
+    # only the file and line of the node's creator.  "full" builds
+    # frame records (with source context) for the whole stack.
+    provenance = "lazy"
+
+    # If set, a graph.GraphWriter to which symbolic_apply streams the
+    # execution graph of each call.  Each call begins a new graph; the
+    # owner of the writer must end the last one.
+    sched_graph = None
+
+    # If non-zero, symbolic_apply explores code paths in this many
+    # worker processes.  Workers hand back the schedules of the paths
+    # they explore, with a token for each implied assumption, and the
+    # calling process re-runs each path from its schedule, without
+    # consulting the solver, in the same order as sequential
+    # exploration.  The workers must be started by start_path_workers
+    # before Z3 is used.  They take the other options from the calling
+    # process, except for verdict_cache and sched_graph, which they
+    # keep from when they were started.
+    path_workers = 0
+
+    # The name of the scheduling strategy (see strategies) that picks
+    # the next schedule to explore, and the seed for the "random"
+    # strategy.  With path workers, paths are still reported in "dfs"
+    # order.
+    strategy = "dfs"
+    strategy_seed = 0
+
+    # Which solver checks assume performs for a new assumption.
+    # "check" checks both whether the assumption is already implied
+    # and whether the path is still satisfiable with it.  "novel"
+    # first treats an assumption that is syntactically identical to a
+    # constraint already on the path as implied, and only checks the
+    # others.  "defer" checks only whether the assumption is implied;
+    # the path's satisfiability is left to the next branch check or
+    # the end of the path.
+    assume_policy = "check"
+
+    # The maximum number of simplified expressions the simplifier
+    # remembers (see Simplifier).  0 disables the cache.
+    simplify_cache_size = 1024
+
+    # If set, checks of a satisfiable conjunction extended with more
+    # constraints (such as test generation's checks against a test's
+    # path condition) only include the conjuncts of the original that
+    # share variables with the extension, and test enumeration solves
+    # independent groups of conjuncts separately.  See Slicer and
+    # Enumerator.  Z3 tends to pick different models for the smaller
+    # queries, so this changes which tests are generated.
+    slice_checks = False
+
+    # Store chains and if-then-else chains with more links than this
+    # are compacted as they are extended (see compact_store and
+    # compact_ite).  0 disables compaction.
+    compact_threshold = 0
+
+# Counters of solver work done by the symbolic executor.  These
+# accumulate over the life of the process, so callers that want
+# per-call set numbers should take differences.
+#
+# branch_checks - Solver queries deciding the feasibility of a branch.
+# branch_slow_checks - Branch queries that were unknown and were
+#   retried with the condition asserted.
+# branch_checks_skipped - Branch polarities settled without a query
+#   because the other polarity was unsat.
+# branch_model_hits - Branch polarities settled by evaluating the
+#   branch condition in the path's last model.
+# verdict_cache_hits, verdict_cache_misses - Lookups in
+#   options.verdict_cache.
+# verdict_cache_uncached - Cache misses whose results weren't recorded
+#   (see cached_query and VerdictCache).
+# verdict_cache_model_misses - Cache misses of queries whose sat
+#   verdict was cached, but whose model was needed.
+# cex_cache_hits, cex_cache_misses - Branch checks answered (or not)
+#   by a CexCache.
+# assume_checks - Solver queries made by assume.
+# assume_checks_skipped - Queries assume avoided because of
+#   options.assume_policy or initial_var.
+# simplify_cache_hits, simplify_cache_misses - Lookups in the
+#   simplifier's cache.
+# sliced_checks - Checks made through a Slicer or sliced by an
+#   Enumerator.
+# sliced_conjuncts - Conjuncts Slicer checks dropped as independent.
+# sliced_model_hits - Models of independent groups of conjuncts that
+#   an Enumerator reused from earlier checks.
+# compactions - Store or if-then-else chains rewritten by compaction.
+# compacted_links - Links dropped from chains by compaction.
+stats = collections.Counter()
+
+# The Z3 sorts of Symbolic types in the current Z3 context, built on
+# demand by Symbolic._z3_sort.  Release them while the z3 module is
+# still intact.
+context_sorts = {}
+atexit.register(context_sorts.clear)
+
+# The InitialVars declared by initial_var in the current Z3 context,
+# keyed by the variable's type and name and the anonymous names its
+# declaration may use.
+initial_vars = {}
+atexit.register(initial_vars.clear)
+
 # Monkey-patch __nonzero__ on Z3 types to make sure we don't
 # accidentally call it instead of our wrappers.
 def z3_nonzero(self):
@@ -70,8 +204,9 @@ class Symbolic(object):
     where they are copied at the point of assignment.
 
     A subclass of Symbolic must have a __z3_sort__ class field giving
-    the compound z3.SortRef for the value's type.  Subclasses must
-    also implement the _z3_value and _wrap_lvalue methods.
+    a function that builds the compound z3.SortRef for the value's
+    type in the current Z3 context.  Subclasses must also implement
+    the _z3_value and _wrap_lvalue methods.
     """
 
     def __init__(self):
@@ -80,7 +215,19 @@ class Symbolic(object):
     @classmethod
     def _z3_sort(cls):
         """Return the compound Z3 sort represented by this class."""
-        return cls.__z3_sort__
+        try:
+            return context_sorts[cls]
+        except KeyError:
+            pass
+        # Synonym types share the sort of the type they were derived
+        # from, so build it only for the class that defines it.
+        owner = next(c for c in cls.__mro__ if "__z3_sort__" in c.__dict__)
+        if owner is cls:
+            sort = cls.__z3_sort__()
+        else:
+            sort = owner._z3_sort()
+        context_sorts[cls] = sort
+        return sort
 
     def _z3_value(self):
         """Return the compound Z3 value wrapped by this object.
@@ -98,24 +245,22 @@ class Symbolic(object):
         concrete values or MODEL_FETCH to retrieve an existing
         variable without binding it to a model.
         """
-        val = [init]
-        def setter(nval):
-            val[0] = nval
-        obj = cls._wrap_lvalue(lambda: val[0], setter, model)
+        obj = cls._wrap_lvalue(LValue(LValueCell(init)), model)
         if model is None and isinstance(obj, Symbolic):
             obj._declare_assumptions(assume)
         return obj
 
     @classmethod
-    def _wrap_lvalue(cls, getter, setter, model):
+    def _wrap_lvalue(cls, lvalue, model):
         """Return a new instance of this class.
 
         Return an instance of this class wrapping the compound Z3
-        value returned by getter.  If this object is immutable, then
-        it should call getter immediately to fetch the object's
-        current value.  If this object is mutable, it should use
-        getter on demand and it should reflect changes to its value by
-        calling setter with its updated compound Z3 value.
+        value stored at lvalue, which is an LValue.  If this object is
+        immutable, then it should call lvalue.get() immediately to
+        fetch the object's current value.  If this object is mutable,
+        it should use lvalue.get() on demand and it should reflect
+        changes to its value by calling lvalue.set() with its updated
+        compound Z3 value.
 
         model, if not None, provides the simsym.Model in which to
         evaluate concrete values or is MODEL_FETCH.  Immutable,
@@ -213,6 +358,11 @@ class Symbolic(object):
         if not isinstance(o, Symbolic):
             return False
         def rec(a, b):
+            # Copies share the compound values of the object they were
+            # copied from until they are written to, so any component
+            # that neither object has modified since then is identical.
+            if a is b:
+                return True
             if isinstance(a, dict) != isinstance(b, dict):
                 return False
             if isinstance(a, dict):
@@ -221,6 +371,7 @@ class Symbolic(object):
                 for k in a.keys():
                     if k not in b or not rec(a[k], b[k]):
                         return False
+                return True
             elif z3.is_ast(a):
                 return z3.is_ast(b) and a.eq(b)
             else:
@@ -242,8 +393,11 @@ class Symbolic(object):
 
     def bind(self, model):
         """Return a deep copy of this object that is bound to model."""
-        return self._new_lvalue(compound_map(lambda x:x, self._z3_value()),
-                                model)
+        # Compound values are never modified in place (LValue.set
+        # copies the dictionaries along the path it updates), so the
+        # copy can share this object's compound value and only the
+        # parts that are later mutated get duplicated.
+        return self._new_lvalue(self._z3_value(), model)
 
 class SymbolicConst(Symbolic):
     """The base class for symbolic constants.  Symbolic constants are
@@ -261,10 +415,10 @@ class SymbolicConst(Symbolic):
         return cls._wrap(z3.Const(name, cls._z3_sort()), model)
 
     @classmethod
-    def _wrap_lvalue(cls, getter, setter, model):
+    def _wrap_lvalue(cls, lvalue, model):
         # Fetch the value immediately, rather than acting like an
         # lvalue.
-        return cls._wrap(getter(), model)
+        return cls._wrap(lvalue.get(), model)
 
     def copy(self):
         """Return a deep copy of this object.
@@ -297,6 +451,328 @@ def compound_mapN(func, compounds):
                 for k in compounds[0].iterkeys()}
     return func(*compounds)
 
+class ChainCache(object):
+    """Remembers the chains that compaction has left in canonical form.
+
+    compact_store and compact_ite must look at a whole chain to find
+    links to drop, which would make building a long chain one link at
+    a time quadratic.  Instead, for each canonical chain they produce,
+    this records the chain's length, the position of each link's index
+    (or condition) by Z3 AST id, the newest link's concrete index, and
+    the rest of the chain below the newest link.  Extending a recorded
+    chain with a link that doesn't repeat an index and doesn't break
+    the order of a run of concrete indexes leaves it canonical, and so
+    does replacing its newest link with one to the same index, so
+    either can be recorded without a walk.  For
+    chains too short to compact, this records just the length, so
+    that they are walked once they grow past the threshold, not on
+    every link.
+
+    The position maps of a chain and its extensions are shared, as
+    long as the chain is extended only once; branching off a chain a
+    second time copies the map.  Like Simplifier, the cache is keyed
+    by AST id, holds on to the ASTs, and keeps the most recently used
+    size entries.
+    """
+
+    size = 4096
+
+    def __init__(self):
+        self.__cache = collections.OrderedDict()
+
+    def clear(self):
+        self.__cache.clear()
+
+    def lookup(self, head):
+        """Return the (length, positions, last, rest) record of head,
+        or None.
+
+        positions is None if head may not be canonical.
+        """
+        ent = self.__cache.pop(head.get_id(), None)
+        if ent is None:
+            return None
+        self.__cache[head.get_id()] = ent
+        return ent[1]
+
+    def add(self, head, keys, rest, last=None):
+        """Record the canonical chain head, whose links have the AST
+        ids keys, oldest first, whose newest link links to rest, and
+        whose newest link has concrete index last (or None)."""
+        self.__put(head, (len(keys), {k: i for i, k in enumerate(keys)},
+                          last, rest))
+
+    def add_length(self, head, length):
+        """Record the length of chain head, which may not be canonical."""
+        self.__put(head, (length, None, None, None))
+
+    def extends(self, rec, key):
+        """Return True if extending the canonical chain with record rec
+        by a link with AST id key needs no compaction."""
+        length, positions, _, _ = rec
+        return positions is not None and positions.get(key, length) >= length
+
+    def replaces_newest(self, rec, key):
+        """Return True if rec is the record of a canonical chain whose
+        newest link has AST id key."""
+        length, positions, _, _ = rec
+        return positions is not None and positions.get(key) == length - 1
+
+    def replace_newest(self, head, rec):
+        """Record head, the canonical chain with record rec with its
+        newest link replaced by one with the same index, which links
+        to the same rest."""
+        self.__put(head, rec)
+
+    def extend(self, head, rec, key, rest, last=None):
+        """Record head, the chain rest with record rec extended by a
+        link with AST id key and concrete index last (or None)."""
+        length, positions, _, _ = rec
+        if len(positions) != length:
+            positions = {k: i for k, i in positions.iteritems()
+                         if i < length}
+        positions[key] = length
+        self.__put(head, (length + 1, positions, last, rest))
+
+    def __put(self, head, rec):
+        self.__cache[head.get_id()] = (head, rec)
+        while len(self.__cache) > self.size:
+            self.__cache.popitem(last=False)
+
+chain_cache = ChainCache()
+atexit.register(chain_cache.clear)
+
+def compact_store(z3map, z3idx, z3val):
+    """Return z3.Store(z3map, z3idx, z3val), compacting long chains.
+
+    If the chain of stores this produces is longer than
+    options.compact_threshold, stores that are overwritten by a later
+    store to the same index are dropped and runs of stores to
+    distinct concrete indexes are put in index order, so states
+    reached by different call orders tend to end up with identical
+    terms.  A store to the index of the newest store of a compacted
+    chain replaces that store, so the chain stays compact.
+    """
+    limit = options.compact_threshold
+    if not limit:
+        return z3.Store(z3map, z3idx, z3val)
+    if not z3.is_ast(z3idx):
+        # A concrete Python index; chains are keyed by index AST
+        z3idx = z3map.domain().cast(z3idx)
+    rec = chain_cache.lookup(z3map)
+    if rec is not None:
+        if chain_cache.extends(rec, z3idx.get_id()):
+            val = z3idx.as_long() if z3.is_int_value(z3idx) else None
+            if val is None or rec[2] is None or val > rec[2]:
+                res = z3.Store(z3map, z3idx, z3val)
+                chain_cache.extend(res, rec, z3idx.get_id(), z3map, val)
+                return res
+        if chain_cache.replaces_newest(rec, z3idx.get_id()):
+            # Keep a compacted chain compact by dropping the store
+            # this overwrites
+            stats["compactions"] += 1
+            stats["compacted_links"] += 1
+            res = z3.Store(rec[3], z3idx, z3val)
+            chain_cache.replace_newest(res, rec)
+            return res
+        if rec[0] < limit:
+            res = z3.Store(z3map, z3idx, z3val)
+            chain_cache.add_length(res, rec[0] + 1)
+            return res
+
+    links = [(z3idx, z3val)]
+    base = z3map
+    while z3.is_store(base):
+        links.append((base.arg(1), base.arg(2)))
+        base = base.arg(0)
+    if len(links) <= limit:
+        res = z3.Store(z3map, z3idx, z3val)
+        chain_cache.add_length(res, len(links))
+        return res
+
+    # links is newest first, so the first store to each index wins
+    seen, kept = set(), []
+    for link in links:
+        if link[0].get_id() not in seen:
+            seen.add(link[0].get_id())
+            kept.append(link)
+    kept.reverse()
+    res, run = [], []
+    for link in kept + [None]:
+        if link is not None and z3.is_int_value(link[0]):
+            run.append(link)
+            continue
+        res.extend(sorted(run, key=lambda link: link[0].as_long()))
+        run = []
+        if link is not None:
+            res.append(link)
+
+    keys = [idx.get_id() for idx, _ in res]
+    newest = res[-1][0]
+    last = newest.as_long() if z3.is_int_value(newest) else None
+    if keys == [idx.get_id() for idx, _ in reversed(links)]:
+        rest, head = z3map, z3.Store(z3map, z3idx, z3val)
+    else:
+        stats["compactions"] += 1
+        stats["compacted_links"] += len(links) - len(res)
+        head = base
+        for idx, val in res:
+            rest, head = head, z3.Store(head, idx, val)
+    chain_cache.add(head, keys, rest, last)
+    return head
+
+def compact_ite(cond, cons, alt):
+    """Return z3.If(cond, cons, alt), compacting long chains.
+
+    If the chain of if-then-else's along the else branches is longer
+    than options.compact_threshold, links whose condition already
+    appears further out in the chain (and hence can never be taken)
+    are dropped.  Repeated symbolic stores to the same element of an
+    SSmallList build exactly such chains.  As with compact_store, a
+    link that shadows the newest link of a compacted chain replaces
+    it.
+    """
+    limit = options.compact_threshold
+    if not limit or not z3.is_ast(alt):
+        # A concrete Python alternative doesn't continue a chain
+        return z3.If(cond, cons, alt)
+    rec = chain_cache.lookup(alt)
+    if rec is not None:
+        if chain_cache.extends(rec, cond.get_id()):
+            res = z3.If(cond, cons, alt)
+            chain_cache.extend(res, rec, cond.get_id(), alt)
+            return res
+        if chain_cache.replaces_newest(rec, cond.get_id()):
+            # Keep a compacted chain compact by dropping the link
+            # this shadows
+            stats["compactions"] += 1
+            stats["compacted_links"] += 1
+            res = z3.If(cond, cons, rec[3])
+            chain_cache.replace_newest(res, rec)
+            return res
+        if rec[0] < limit:
+            res = z3.If(cond, cons, alt)
+            chain_cache.add_length(res, rec[0] + 1)
+            return res
+
+    links = [(cond, cons)]
+    base = alt
+    while z3.is_app_of(base, z3.Z3_OP_ITE):
+        links.append((base.arg(0), base.arg(1)))
+        base = base.arg(2)
+    if len(links) <= limit:
+        res = z3.If(cond, cons, alt)
+        chain_cache.add_length(res, len(links))
+        return res
+
+    seen, kept = set(), []
+    for link in links:
+        if link[0].get_id() not in seen:
+            seen.add(link[0].get_id())
+            kept.append(link)
+    if len(kept) == len(links):
+        rest, head = alt, z3.If(cond, cons, alt)
+    else:
+        stats["compactions"] += 1
+        stats["compacted_links"] += len(links) - len(kept)
+        head = base
+        for c, val in reversed(kept):
+            rest, head = head, z3.If(c, val, head)
+    chain_cache.add(head, [c.get_id() for c, _ in reversed(kept)], rest)
+    return head
+
+class LValueCell(object):
+    """A mutable holder for the compound Z3 value of a root lvalue.
+
+    version is bumped on every update, so LValues derived from this
+    cell can tell when their cached values have gone stale.
+    """
+
+    __slots__ = ["value", "version"]
+
+    def __init__(self, value):
+        self.value = value
+        self.version = 0
+
+class LValue(object):
+    """A location in the compound Z3 value held by an LValueCell.
+
+    A location is a path of struct field names and map indexes from
+    the root of the cell.  Since a compound map is a dictionary of Z3
+    arrays, field names always apply to the dictionary structure and
+    indexes to the arrays at its leaves, so the two are kept as
+    separate tuples and selects are only built for the leaves that are
+    actually reached.  The resolved value is cached until the cell is
+    next updated.
+
+    Compound values are never modified in place: set() copies the
+    dictionaries along the path, so values returned by get() may be
+    shared freely.
+    """
+
+    __slots__ = ["cell", "fields", "idxs", "__version", "__value"]
+
+    def __init__(self, cell, fields=(), idxs=()):
+        self.cell = cell
+        self.fields = fields
+        self.idxs = idxs
+        self.__version = None
+
+    def field(self, name):
+        """Return the LValue of struct field name of this location."""
+        return LValue(self.cell, self.fields + (name,), self.idxs)
+
+    def index(self, z3idx):
+        """Return the LValue of index z3idx of this location."""
+        return LValue(self.cell, self.fields, self.idxs + (z3idx,))
+
+    def __base(self):
+        val = self.cell.value
+        for name in self.fields:
+            val = val[name]
+        return val
+
+    def get(self):
+        """Return the current compound Z3 value at this location."""
+        cell = self.cell
+        if self.__version != cell.version:
+            val = self.__base()
+            if self.idxs:
+                idxs = self.idxs
+                def select(z3val):
+                    for z3idx in idxs:
+                        z3val = z3.Select(z3val, z3idx)
+                    return z3val
+                val = compound_map(select, val)
+            self.__value, self.__version = val, cell.version
+        return self.__value
+
+    def set(self, val):
+        """Replace the compound Z3 value at this location with val."""
+        if self.idxs:
+            idxs = self.idxs
+            def store(z3map, z3val, i=0):
+                z3idx = idxs[i]
+                if i + 1 < len(idxs):
+                    z3val = store(z3.Select(z3map, z3idx), z3val, i + 1)
+                # If we have an array of structs, assigning to a
+                # single struct field will cause an identity update
+                # of all of the other fields.  Avoid building up huge,
+                # pointless Store expressions.
+                if z3.is_ast(z3val) and z3map[z3idx].eq(z3val):
+                    return z3map
+                return compact_store(z3map, z3idx, z3val)
+            val = compound_map(store, self.__base(), val)
+        def replace(compound, i):
+            if i == len(self.fields):
+                return val
+            res = dict(compound)
+            res[self.fields[i]] = replace(compound[self.fields[i]], i + 1)
+            return res
+        cell = self.cell
+        cell.value = replace(cell.value, 0)
+        cell.version += 1
+
 def flatten_compound(compound):
     """Return a list of compound's leafs.
 
@@ -436,7 +912,7 @@ class SArith(SExpr):
 
 class SInt(SArith, SymbolicConst):
     __pass_type__ = int
-    __z3_sort__ = z3.IntSort()
+    __z3_sort__ = staticmethod(z3.IntSort)
 
     # Note that we're wrapping ArithRefs, not IntNumRefs.  Z3's Ref
     # hierarchy reflects AST structure, while our types reflect Z3
@@ -462,7 +938,10 @@ class UncheckableConstraintError(RuntimeError):
         self.expr = expr
 
 class UnsatisfiablePath(RuntimeError):
-    pass
+    def __init__(self, node=None):
+        RuntimeError.__init__(self)
+        # The assumption SchedNode that made the path unsatisfiable
+        self.node = node
 
 class ReplayDivergedError(RuntimeError):
     def __init__(self, old, new):
@@ -472,74 +951,79 @@ class ReplayDivergedError(RuntimeError):
 class SBool(SExpr, SymbolicConst):
     __ref_type__ = z3.BoolRef
     __pass_type__ = bool
-    __z3_sort__ = z3.BoolSort()
+    __z3_sort__ = staticmethod(z3.BoolSort)
 
     def __nonzero__(self):
         if self._model and self._model is not MODEL_FETCH:
             return self.val
 
         scheduler, path_state = Env.scheduler(), Env.path_state()
-        solver = path_state.solver
         cursched = path_state.sched
 
-        if len(cursched) == path_state.schedidx:
-            # We've reached the end of replay; extend the schedule
-            solver.push()
-            solver.add(self._v)
-            canTrue = solver.check()
-            canTrueReason = solver.reason_unknown()
-            if canTrue == z3.unknown:
-                # Stack operations change how Z3 "compiles" formulas,
-                # so it's possible it can solve it in isolation.
-                s2 = z3.Solver()
-                s2.add(*solver.assertions())
-                canTrue = s2.check()
-                canTrueReason = s2.reason_unknown()
-            solver.pop()
-
-            solver.push()
-            solver.add(z3.Not(self._v))
-            canFalse = solver.check()
-            canFalseReason = solver.reason_unknown()
-            if canFalse == z3.unknown:
-                s2 = z3.Solver()
-                s2.add(*solver.assertions())
-                canFalse = s2.check()
-                canFalseReason = s2.reason_unknown()
-            solver.pop()
-
-            if canTrue == z3.unsat and canFalse == z3.unsat:
-                raise RuntimeError("Branch contradiction")
+        models = {}
+        forced = path_state.forced_token()
+        if forced is not None:
+            cursched.append(SchedNode.from_token(forced, self))
+        elif len(cursched) == path_state.schedidx:
+            # We've reached the end of replay; extend the schedule.
+            # First try to settle the branch using the path's last
+            # model, so that at most one polarity needs the solver.
+            known = path_state.eval_model(self._v)
+            if known is True:
+                stats["branch_model_hits"] += 1
+                canTrue = CheckResult(z3.sat, path_state.model)
+            else:
+                canTrue = path_state.check(self._v)
+            if known is False:
+                stats["branch_model_hits"] += 1
+                canFalse = CheckResult(z3.sat, path_state.model)
+            elif canTrue.is_unsat and path_state.unchecked is None:
+                # Every constraint on this path was satisfiable when
+                # we followed it, so the false side must be.
+                stats["branch_checks_skipped"] += 1
+                canFalse = CheckResult(z3.sat)
+            else:
+                canFalse = path_state.check(z3.Not(self._v))
+            if path_state.unchecked is not None:
+                # This settles any deferred assumptions
+                if canTrue.is_unsat and canFalse.is_unsat:
+                    raise UnsatisfiablePath(path_state.unchecked)
+                if canTrue.is_sat or canFalse.is_sat:
+                    path_state.unchecked = None
+            if canTrue.is_sat:
+                models[True] = canTrue.z3_model
+            if canFalse.is_sat:
+                models[False] = canFalse.z3_model
 
             # Extend the schedule
-            if canTrue == z3.sat and canFalse == z3.unsat:
+            if canTrue.is_sat and canFalse.is_unsat:
                 cursched.append(SchedNode("branch_det", self, True))
-            elif canTrue == z3.unsat and canFalse == z3.sat:
+            elif canTrue.is_unsat and canFalse.is_sat:
                 cursched.append(SchedNode("branch_det", self, False))
             else:
                 # Both are possible (or at least one is unknown)
                 newsched = list(cursched)
-                if canTrue == z3.sat:
+                if canTrue.is_sat:
                     cursched.append(SchedNode("branch_nondet", self, True))
-                elif canTrue == z3.unknown:
+                elif canTrue.is_unknown:
                     cursched.append(
                         SchedNode("exception", True,
                                   UncheckableConstraintError(
-                                      self._v, canTrueReason)))
+                                      self._v, canTrue.reason)))
                 else:
-                    assert canTrue == z3.unsat and canFalse == z3.unknown
+                    assert canTrue.is_unsat and canFalse.is_unknown
                     # There's actually only one way to go
                     newsched = cursched
 
-                if canFalse == z3.sat:
+                if canFalse.is_sat:
                     newsched.append(SchedNode("branch_nondet", self, False))
-                elif canFalse == z3.unknown:
+                elif canFalse.is_unknown:
                     newsched.append(
                         SchedNode("exception", False,
                                   UncheckableConstraintError(
-                                      z3.Not(self._v), canFalseReason)))
+                                      z3.Not(self._v), canFalse.reason)))
                 else:
-                    assert canFalse == z3.unsat and canTrue == z3.unknown
+                    assert canFalse.is_unsat and canTrue.is_unknown
                     newsched = cursched
 
                 if newsched is not cursched:
@@ -554,7 +1038,7 @@ class SBool(SExpr, SymbolicConst):
         node = cursched[path_state.schedidx]
         path_state.schedidx += 1
         if node.is_branch():
-            solver.add(unwrap(node.path_expr()))
+            path_state.add_constraint(node, models.get(node.val))
             return node.val
         elif node.typ == "exception":
             raise node.val
@@ -571,11 +1055,21 @@ def tuninterpreted(name):
     constants.
     """
     return type(name, (SUninterpretedBase, SymbolicConst),
-                {"__z3_sort__": z3.DeclareSort(name)})
+                {"__z3_sort__": staticmethod(lambda: z3.DeclareSort(name))})
 
 class SEnumBase(SExpr):
     __ref_type__ = z3.DatatypeRef
 
+class EnumConstant(object):
+    """A class field giving one of the values of an enumeration type
+    as a Z3 constant in the current Z3 context."""
+
+    def __init__(self, idx):
+        self.idx = idx
+
+    def __get__(self, obj, cls):
+        return cls._z3_sort().constructor(self.idx)()
+
 def tenum(name, vals):
     """Return a symbolic constant enumeration type called 'name' with
     the given values.  'vals' must be a list of strings or a string of
@@ -585,9 +1079,8 @@ def tenum(name, vals):
 
     if isinstance(vals, basestring):
         vals = vals.split()
-    sort, consts = z3.EnumSort(name, vals)
-    fields = dict(zip(vals, consts))
-    fields["__z3_sort__"] = sort
+    fields = {val: EnumConstant(idx) for idx, val in enumerate(vals)}
+    fields["__z3_sort__"] = staticmethod(lambda: z3.EnumSort(name, vals)[0])
     return type(name, (SEnumBase, SymbolicConst), fields)
 
 class STupleBase(SExpr):
@@ -603,15 +1096,16 @@ def ttuple(name, *types):
     # XXX Broken: synonym types, assumptions
     raise Exception("Sorry, ttuple is broken right now")
 
-    sort = z3.Datatype(name)
-    sort.declare(name, *[(fname, typ._z3_sort()) for fname, typ in types])
-    sort = sort.create()
-    fields = {"__z3_sort__" : sort}
+    def sort():
+        dt = z3.Datatype(name)
+        dt.declare(name, *[(fname, typ._z3_sort()) for fname, typ in types])
+        return dt.create()
+    fields = {"__z3_sort__" : staticmethod(sort)}
     for fname, typ in types:
         code = """\
 @property
 def %s(self):
-    return wrap(self.__z3_sort__.%s(self._v))""" % (fname, fname)
+    return wrap(self._z3_sort().%s(self._v))""" % (fname, fname)
         locals_dict = {}
         exec code in globals(), locals_dict
         fields[fname] = locals_dict[fname]
@@ -629,8 +1123,8 @@ class SConstMapBase(SExpr):
     def store(self, index, value):
         """Return a new map that is identical for this map except that
         'index' will map to 'value'."""
-        return self._wrap(z3.Store(unwrap(self), unwrap(index), unwrap(value)),
-                          None)
+        return self._wrap(compact_store(unwrap(self), unwrap(index),
+                                        unwrap(value)), None)
 
 def tconstmap(indexType, valueType):
     """Return an immutable map type (a z3 "array") that maps from
@@ -638,9 +1132,10 @@ def tconstmap(indexType, valueType):
     'valueType'.  The returned type will inherit from SConstMapBase
     and SymbolicConst."""
 
-    sort = z3.ArraySort(indexType._z3_sort(), valueType._z3_sort())
+    sort = lambda: z3.ArraySort(indexType._z3_sort(), valueType._z3_sort())
     name = "SConstMap_%s_%s" % (indexType.__name__, valueType.__name__)
-    return type(name, (SConstMapBase, SymbolicConst), {"__z3_sort__" : sort})
+    return type(name, (SConstMapBase, SymbolicConst),
+                {"__z3_sort__" : staticmethod(sort)})
 
 #
 # Type synonyms
@@ -668,17 +1163,16 @@ class SMapBase(Symbolic):
             None)
 
     @classmethod
-    def _wrap_lvalue(cls, getter, setter, model):
+    def _wrap_lvalue(cls, lvalue, model):
         # XXX Make this generic?
         obj = cls.__new__(cls)
-        obj._getter = getter
-        obj._setter = setter
+        obj._lvalue = lvalue
         obj._model = model
         return obj
 
     def _z3_value(self):
         # XXX Make this generic, too?
-        return self._getter()
+        return self._lvalue.get()
 
     def _declare_assumptions(self, assume):
         super(SMapBase, self)._declare_assumptions(assume)
@@ -690,7 +1184,7 @@ class SMapBase(Symbolic):
             return NotImplemented
         if isinstance(self._valueType, SExpr):
             # Optimize away the forall
-            vs, vo = self._getter(), o._getter()
+            vs, vo = self._z3_value(), o._z3_value()
             assert not isinstance(vs, dict)
             assert not isinstance(vo, dict)
             return wrap(vs == vo)
@@ -702,25 +1196,12 @@ class SMapBase(Symbolic):
 
     def __getitem__(self, idx):
         """Return the value at index 'idx'."""
-        z3idx = unwrap(idx)
         return self._valueType._wrap_lvalue(
-            lambda: compound_map(
-                lambda z3val: z3.Select(z3val, z3idx), self._getter()),
-            lambda val: self.__setitem__(idx, val),
-            self._model)
+            self._lvalue.index(unwrap(idx)), self._model)
 
     def __setitem__(self, idx, val):
         """Change the value at index 'idx'."""
-        z3idx = unwrap(idx)
-        def set1(z3map, z3val):
-            # If we have an array of structs, assigning to a single
-            # struct field will cause an identity update of all of the
-            # other fields.  Avoid building up huge, pointless Store
-            # expressions.
-            if z3.is_ast(z3val) and z3map[z3idx].eq(z3val):
-                return z3map
-            return z3.Store(z3map, z3idx, z3val)
-        self._setter(compound_map(set1, self._getter(), unwrap(val)))
+        self._lvalue.index(unwrap(idx)).set(unwrap(val))
 
 def tmap(indexType, valueType):
     """Return a subclass of SMapBase that maps from 'indexType' to
@@ -729,14 +1210,15 @@ def tmap(indexType, valueType):
     # ordered sort
     name = "SMap_%s_%s" % (indexType.__name__, valueType.__name__)
 
-    indexSort = indexType._z3_sort()
-    if isinstance(indexSort, dict):
+    if isinstance(indexType._z3_sort(), dict):
         raise TypeError("Map index may not be a compound type")
-    sort = compound_map(lambda z3sort: z3.ArraySort(indexSort, z3sort),
-                        valueType._z3_sort())
+    def sort():
+        indexSort = indexType._z3_sort()
+        return compound_map(lambda z3sort: z3.ArraySort(indexSort, z3sort),
+                            valueType._z3_sort())
     return type(name, (SMapBase,),
                 {"_indexType" : indexType, "_valueType" : valueType,
-                 "__z3_sort__" : sort})
+                 "__z3_sort__" : staticmethod(sort)})
 
 class SStructBase(Symbolic):
     """The base type of symbolic mutable structure types.  Structure
@@ -777,16 +1259,15 @@ class SStructBase(Symbolic):
         return cls._new_lvalue(z3_val, __model)
 
     @classmethod
-    def _wrap_lvalue(cls, getter, setter, model):
+    def _wrap_lvalue(cls, lvalue, model):
         obj = cls.__new__(cls)
         # Don't go through the overridden __setattr__.
-        object.__setattr__(obj, "_getter", getter)
-        object.__setattr__(obj, "_setter", setter)
+        object.__setattr__(obj, "_lvalue", lvalue)
         object.__setattr__(obj, "_model", model)
         return obj
 
     def _z3_value(self):
-        return self._getter()
+        return self._lvalue.get()
 
     def _declare_assumptions(self, assume):
         super(SStructBase, self)._declare_assumptions(assume)
@@ -805,16 +1286,12 @@ class SStructBase(Symbolic):
         if name not in self._fields:
             raise AttributeError(name)
         return self._fields[name]._wrap_lvalue(
-            lambda: self._getter()[name],
-            lambda val: self.__setattr__(name, val),
-            self._model)
+            self._lvalue.field(name), self._model)
 
     def __setattr__(self, name, val):
         if name not in self._fields:
             raise AttributeError(name)
-        cval = self._getter()
-        cval[name] = unwrap(val)
-        self._setter(cval)
+        self._lvalue.field(name).set(unwrap(val))
 
 def tstruct(**fields):
     """Return a subclass of SStructBase for a struct type with the
@@ -822,8 +1299,9 @@ def tstruct(**fields):
     symbolic types."""
 
     name = "SStruct_" + "_".join(fields.keys())
-    sort = {fname: typ._z3_sort() for fname, typ in fields.items()}
-    type_fields = {"__slots__": [], "_fields": fields, "__z3_sort__": sort}
+    sort = lambda: {fname: typ._z3_sort() for fname, typ in fields.items()}
+    type_fields = {"__slots__": [], "_fields": fields,
+                   "__z3_sort__": staticmethod(sort)}
     return type(name, (SStructBase,), type_fields)
 
 #
@@ -873,7 +1351,16 @@ def symeq(*exprs):
     return symand([a == b for a, b in zip(exprs, exprs[1:])])
 
 def symif(pred, cons, alt):
-    e = z3.If(unwrap(pred), unwrap(cons), unwrap(alt))
+    # Fold concrete predicates and identical branches
+    if isinstance(pred, (bool, int, long)):
+        return cons if pred else alt
+    if isinstance(cons, (bool, int, long)) and type(cons) == type(alt):
+        if cons == alt:
+            return cons
+    elif options.eq_eliminate_structural and isinstance(cons, Symbolic) \
+         and cons.eq(alt):
+        return cons
+    e = compact_ite(unwrap(pred), unwrap(cons), unwrap(alt))
     # Wrap the result in the type of the consequent, rather than a
     # generic SExpr.
     if isinstance(cons, Symbolic):
@@ -886,6 +1373,11 @@ def distinct(*exprlist):
     return wrap(z3.Distinct(*map(unwrap, exprlist)))
 
 def implies(a, b):
+    # Simplify concrete antecedents and consequents
+    if not isinstance(a, Symbolic):
+        return b if a else True
+    if not isinstance(b, Symbolic):
+        return True if b else symnot(a)
     return wrap(z3.Implies(unwrap(a), unwrap(b)))
 
 def exists(vars, e, patterns=[]):
@@ -1007,58 +1499,151 @@ def ast_cleanup(a):
 # Execution graph visualization
 #
 
-class SchedGraph(graph.Graph):
-    def __init__(self):
-        super(SchedGraph, self).__init__()
-        self.node_attrs(shape="box")
+class SchedGraph(object):
+    """Stream the execution graph of a symbolic_apply to a GraphWriter."""
+
+    def __init__(self, writer):
+        self.__writer = writer
+        writer.begin(shape="box")
         # SchedNodes are graph *edges*.  When the schedule forks,
         # we'll get two SchedNodes with identical metadata but
         # different vals.  For each graph node, we pick the first edge
         # out of it we see to represent that graph node and we
-        # identify it by its predecessor SchedNode (which can be
-        # thought of as the edge tail going in to the graph node).
-        self.__tail_to_gnode = {}
+        # identify it by the path through the schedule tree that
+        # leads to it, that is, by the tokens of the SchedNodes before
+        # it.  With path workers, each path is re-created from its
+        # tokens with new SchedNode objects, so the SchedNodes
+        # themselves can't identify it.  Each graph node has a unique
+        # incoming edge, so we write that edge when we write the node.
+        #
+        # The paths are kept in a trie whose nodes are [gnode,
+        # {token: child}, children left] lists.  A subtrie is dropped
+        # once every path through it has been added, so this only
+        # holds the part of the schedule tree whose exploration is
+        # still under way.
+        self.__trie = [None, {}, None]
 
     def add_sched(self, sched, result, result_color=None):
-        prev_snode = None
-        path = []
+        trie = self.__trie
+        tries = []
+        prev = None
         for snode in sched:
             if snode.typ in ("assumption", "branch_nondet"):
-                gnode = self.__tail_to_gnode.get(prev_snode)
+                gnode = trie[0]
                 if gnode is None:
-                    gnode = self.__tail_to_gnode[prev_snode] = self.node(snode)
+                    gnode = trie[0] = self.__writer.node(**self.__attrs(snode))
+                    if prev is not None:
+                        self.__writer.edge(prev[0], gnode, **prev[1])
                 if snode.typ == "branch_nondet":
                     edge_attrs = {"label": str(snode.val)[0]}
                 else:
                     edge_attrs = {}
-                path.append((gnode, edge_attrs))
-            prev_snode = snode
-        path.append((self.node(result, unique=True, color=result_color), {}))
-        for (n1, attrs), (n2, _) in zip(path, path[1:]):
-            self.edge(n1, n2, **attrs)
-
-    def obj_attrs(self, node):
-        if isinstance(node, SchedNode):
-            parts = []
-            if node.expr is not None:
-                parts.append(str(z3.simplify(unwrap(node.expr))))
-            parts.append("%s:%s" % (os.path.basename(node.frames[0].filename),
-                                    node.frames[0].lineno))
-            label = "\n".join(parts)
-        else:
-            label = str(node)
+                prev = (gnode, edge_attrs)
+            token = snode.token()
+            if not isinstance(token, basestring):
+                # An uncheckable branch; its reason doesn't matter
+                token = token[0]
+            if trie[2] is None:
+                # A fork has two sides.  (An uncheckable branch may
+                # have only one, in which case its subtrie is kept.)
+                trie[2] = 2 if token in ("T", "F", "X", "x") else 1
+            tries.append((trie, token))
+            trie = trie[1].setdefault(token, [None, {}, None])
+        rnode = self.__writer.node(label=self.__trim(result),
+                                   color=result_color)
+        if prev is not None:
+            self.__writer.edge(prev[0], rnode, **prev[1])
+
+        # This path is done; drop the subtries it completes
+        for trie, token in reversed(tries):
+            del trie[1][token]
+            trie[2] -= 1
+            if trie[2]:
+                break
+
+    def __attrs(self, node):
+        parts = []
+        if node.expr is not None:
+            parts.append(str(z3.simplify(unwrap(node.expr))))
+        filename, lineno = node.location()
+        parts.append("%s:%s" % (os.path.basename(filename), lineno))
+        return {"label": self.__trim("\n".join(parts))}
 
-        # Trim label
+    def __trim(self, label):
         if len(label.splitlines()) > 10:
             lines = label.splitlines()
             lines = lines[:5] + [".. %d more lines .." % (len(lines) - 9)] + lines[-4:]
             label = "\n".join(lines)
-        return {"label": label}
+        return label
 
 #
 # Symbolic executor
 #
 
+class CowDict(collections.MutableMapping):
+    """A dictionary with constant-time copy.
+
+    A CowDict and its copies share frozen layers of entries, and each
+    records its own changes in a private top layer.  Copying freezes
+    the top layer, so neither dictionary sees the other's later
+    changes.
+    """
+
+    # Flatten the frozen layers once there are more than this many,
+    # so lookups stay cheap no matter how often a dict is copied.
+    MAX_DEPTH = 8
+
+    __deleted = object()
+
+    def __init__(self, layers=()):
+        self.__top = {}
+        self.__layers = layers
+
+    def copy(self):
+        if self.__top:
+            layers = (self.__top,) + self.__layers
+            if len(layers) > self.MAX_DEPTH:
+                flat = {}
+                for layer in reversed(layers):
+                    flat.update(layer)
+                layers = ({k: v for k, v in flat.iteritems()
+                           if v is not self.__deleted},)
+            self.__top, self.__layers = {}, layers
+        return CowDict(self.__layers)
+
+    def __getitem__(self, key):
+        if key in self.__top:
+            val = self.__top[key]
+        else:
+            for layer in self.__layers:
+                if key in layer:
+                    val = layer[key]
+                    break
+            else:
+                raise KeyError(key)
+        if val is self.__deleted:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self.__top[key] = val
+
+    def __delitem__(self, key):
+        self[key]
+        self.__top[key] = self.__deleted
+
+    def __iter__(self):
+        seen = set()
+        for layer in (self.__top,) + self.__layers:
+            for key, val in layer.iteritems():
+                if key not in seen:
+                    seen.add(key)
+                    if val is not self.__deleted:
+                        yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 class Env(object):
     """Execution environment.
 
@@ -1076,11 +1661,14 @@ class Env(object):
         # instance constructors.  Each instance constructor must take
         # two arguments: the user variable name and a simsym.Model
         # object that binds the Z3 environment.
-        self.var_constructors = parent.var_constructors.copy() if parent else {}
+        # These are CowDicts, so a path's Env shares its parent's
+        # declarations and only stores the ones the path adds.
+        self.var_constructors = \
+            parent.var_constructors.copy() if parent else CowDict()
 
         # Map from Z3 constant names to (outer Symbolic type, compound
         # path)
-        self.const_types = parent.const_types.copy() if parent else {}
+        self.const_types = parent.const_types.copy() if parent else CowDict()
 
         # Anonymous variable index.  It's important that each code
         # path start with the same anonymous index to make replay
@@ -1156,13 +1744,32 @@ class SchedNode(object):
         self.expr = expr
         self.val = val
 
-        # Unwind out of this module and record the call stack
-        frames = [inspect.getframeinfo(frrec[0], 3)
-                  for frrec in inspect.stack()]
-        for i, frame in enumerate(frames):
-            if frames[0].filename != frame.filename:
-                break
-        self.frames = frames[i:]
+        if options.provenance == "full":
+            # Unwind out of this module and record the call stack
+            frames = [inspect.getframeinfo(frrec[0], 3)
+                      for frrec in inspect.stack()]
+            for i, frame in enumerate(frames):
+                if frames[0].filename != frame.filename:
+                    break
+            self.__frames = frames[i:]
+            return
+
+        # Unwind out of this module and record just the file and line
+        # of the caller.  Like the full stack above, this falls back
+        # to the outermost frame if every frame is in this module.
+        f = sys._getframe()
+        here = f.f_code.co_filename
+        while f.f_back is not None and f.f_code.co_filename == here:
+            f = f.f_back
+        self.__location = (f.f_code.co_filename, f.f_lineno)
+        self.__frames = None
+
+    def location(self):
+        """Return the (filename, lineno) where this node was created."""
+
+        if self.__frames is None:
+            return self.__location
+        return self.__frames[0].filename, self.__frames[0].lineno
 
     def __repr__(self):
         return "SchedNode(%r, %r, %r)" % (self.typ, self.expr, self.val)
@@ -1178,6 +1785,217 @@ class SchedNode(object):
             return symnot(self.expr)
         raise ValueError("No path expression for %r" % self)
 
+    def token(self):
+        """Return a picklable token recording this node's outcome.
+
+        Tokens are "T" and "F" for non-deterministic branches, "t" and
+        "f" for deterministic branches, "a" for assumptions, "n" for
+        notes, and ("X", reason) or ("x", reason) for an uncheckable
+        true or false branch.  path_worker also uses "u" for an
+        unsatisfiable assumption and "i" for an implied assumption,
+        which has no SchedNode.  A list of tokens is enough to
+        re-create a schedule (see ForcedSchedule).
+        """
+
+        if self.typ == "branch_nondet":
+            return "T" if self.val else "F"
+        elif self.typ == "branch_det":
+            return "t" if self.val else "f"
+        elif self.typ == "assumption":
+            return "a"
+        elif self.typ == "note":
+            return "n"
+        return ("X" if self.expr else "x", self.val.args[0])
+
+    @classmethod
+    def from_token(cls, token, expr):
+        """Return the SchedNode for branch token at SBool expr."""
+
+        if token in ("T", "F"):
+            return cls("branch_nondet", expr, token == "T")
+        elif token in ("t", "f"):
+            return cls("branch_det", expr, token == "t")
+        elif isinstance(token, tuple):
+            side = token[0] == "X"
+            cond = expr._v if side else z3.Not(expr._v)
+            return cls("exception", side,
+                       UncheckableConstraintError(cond, token[1]))
+        raise ReplayDivergedError(token, "branch")
+
+class ForcedSchedule(list):
+    """A schedule that is re-created from recorded tokens.
+
+    A ForcedSchedule starts out empty.  Each time the code path
+    reaches the end of the schedule, the next token from forced (see
+    SchedNode.token) decides the outcome of the branch or assumption.
+    Once the tokens run out, the path continues like any other.
+    Copies made when the schedule forks are plain lists.
+
+    If marks_implied is True, forced has an "i" token for every
+    assumption that is implied, as path_worker records the paths it
+    explores, and the schedule is re-created without consulting the
+    solver.  Otherwise, implied assumptions may have no token, and an
+    assumption whose token is "a" or "u" is checked for whether it is
+    implied.
+    """
+
+    def __init__(self, forced, marks_implied=False):
+        super(ForcedSchedule, self).__init__()
+        self.forced = forced
+        self.marks_implied = marks_implied
+
+def token_order(tokens):
+    """Return a sort key for a list of schedule tokens.
+
+    Sorting complete schedules by this key puts them in the order
+    that sequential exploration visits them.  The key of a schedule
+    prefix is less than the keys of all schedules that extend it.
+    """
+
+    return tuple(0 if t[0] in ("T", "X") else 1
+                 for t in tokens if t[0] in ("T", "F", "X", "x"))
+
+def pack_tokens(tokens):
+    """Return a compact, JSON-serializable form of a token list.
+
+    Token lists without uncheckable branches pack into a string of
+    one character per token.
+    """
+
+    if all(isinstance(t, basestring) for t in tokens):
+        return "".join(tokens)
+    return [t if isinstance(t, basestring) else list(t) for t in tokens]
+
+def unpack_tokens(packed):
+    """Return the token list packed by pack_tokens."""
+    return [t if isinstance(t, basestring) else tuple(t) for t in packed]
+
+class CexCache(object):
+    """A counterexample cache for branch checks.
+
+    Path constraints only grow along a code path, so a branch check
+    is a query on a set of constraints that is often a superset or a
+    subset of an earlier query.  Any superset of an unsatisfiable set
+    is unsatisfiable, and a model of a satisfiable set satisfies each
+    of its subsets.  Queries are sets of Z3 AST ids; the cache holds
+    on to the ASTs so their ids aren't reused.
+
+    Since path constraints are asserted rather than assumed, Z3 can't
+    give us unsat cores over them, so the unsat sets recorded here are
+    whole queries rather than minimal cores.
+
+    Each index keeps only the options.cex_cache_entries most recent
+    sets, newest first, since queries on nearby code paths are the
+    likeliest to subsume each other.
+    """
+
+    def __init__(self):
+        self.__asts = {}
+        new_index = lambda: collections.deque(
+            maxlen=options.cex_cache_entries)
+        # Unsat sets, indexed by the query literal they were checked
+        # for.  A later query can only be a superset of one of these
+        # if it checks the same literal, since the literal isn't
+        # satisfiable together with the rest of the set.
+        self.__unsat = collections.defaultdict(new_index)
+        # Sat sets and their models, indexed by every member.
+        self.__sat = collections.defaultdict(new_index)
+
+    def intern(self, expr):
+        """Return the id of Z3 AST expr, keeping expr alive."""
+        i = expr.get_id()
+        self.__asts.setdefault(i, expr)
+        return i
+
+    def lookup(self, query, lit):
+        """Look up the query set with query literal id lit.
+
+        Returns a CheckResult, or None if the cache can't answer.
+        """
+
+        for cset in self.__unsat[lit]:
+            if cset <= query:
+                stats["cex_cache_hits"] += 1
+                return CheckResult(z3.unsat)
+        for cset, model in self.__sat[lit]:
+            if query <= cset:
+                stats["cex_cache_hits"] += 1
+                return CheckResult(z3.sat, model)
+        stats["cex_cache_misses"] += 1
+        return None
+
+    def add(self, query, lit, res):
+        """Record CheckResult res for the query set with literal lit."""
+
+        if res.is_unsat:
+            self.__unsat[lit].appendleft(query)
+        elif res.is_sat and res.z3_model is not None:
+            ent = (query, res.z3_model)
+            for i in query:
+                self.__sat[i].appendleft(ent)
+
+class Strategy(object):
+    """A policy for picking the next schedule for a Scheduler.
+
+    This base class explores depth-first, like a stack.
+    """
+
+    def pick(self, schedq):
+        """Return the index in schedq of the schedule to explore next."""
+        return len(schedq) - 1
+
+    def queued(self, sched):
+        """Called when a schedule is queued while following a path."""
+        pass
+
+    def path_done(self, sched, value):
+        """Called when a code path with schedule sched completes.
+
+        value is the value returned by the code path, or None if it
+        raised an UncheckableConstraintError.
+        """
+        pass
+
+class BFSStrategy(Strategy):
+    """Explore schedules in the order they were queued."""
+
+    def pick(self, schedq):
+        return 0
+
+class RandomStrategy(Strategy):
+    """Explore schedules in a random order seeded by options.strategy_seed."""
+
+    def __init__(self):
+        self.__random = random.Random(options.strategy_seed)
+
+    def pick(self, schedq):
+        return self.__random.randrange(len(schedq))
+
+def schedule_forks(sched):
+    """Return the number of non-deterministic forks in schedule sched.
+
+    A ForcedSchedule that hasn't been replayed yet has no nodes, so
+    this counts its forced tokens instead.
+    """
+
+    if len(sched) < len(getattr(sched, "forced", ())):
+        return sum(1 for t in sched.forced if t in ("T", "F"))
+    return sum(1 for node in sched if node.typ == "branch_nondet")
+
+class ShortestStrategy(Strategy):
+    """Explore the schedules with the fewest forks (shortest pathids) first.
+
+    Ties go to the most recently queued schedule.
+    """
+
+    def pick(self, schedq):
+        return min(reversed(xrange(len(schedq))),
+                   key=lambda i: schedule_forks(schedq[i]))
+
+# Scheduling strategies by name.  Other modules can add their own.
+strategies = {"dfs": Strategy, "bfs": BFSStrategy,
+              "random": RandomStrategy, "shortest": ShortestStrategy}
+
 class Scheduler(object):
     """Tracks the schedule for the current symbolic apply."""
 
@@ -1185,23 +2003,302 @@ class Scheduler(object):
         # Stack of schedules; each schedule is a list of SchedNodes
         self.schedq = []
 
+        # For incremental exploration, the solver shared by all code
+        # paths and the list of SchedNodes whose path expressions are
+        # currently asserted in it.  Each asserted node has its own
+        # solver scope.  With a verdict cache, asserted_digests holds
+        # the VerdictCache.digest of each of these path expressions.
+        self.solver = None
+        self.asserted = []
+        self.asserted_digests = []
+        self.__prev_path_state = None
+
+        self.cex_cache = CexCache() if options.cex_cache else None
+
+        self.strategy = strategies[options.strategy]()
+
+        # If set, a function that returns pending() for schedules that
+        # are being explored elsewhere (see parallel_schedules).
+        self.remote_pending = None
+
         # Prime the schedule
         self.queue_schedule([])
 
     def queue_schedule(self, s):
         self.schedq.append(s)
+        self.strategy.queued(s)
 
     def schedule_generator(self):
         while len(self.schedq) > 0:
-            yield self.schedq.pop()
+            yield self.schedq.pop(self.strategy.pick(self.schedq))
+
+    def pending(self):
+        """Return token lists for the schedules left to explore.
+
+        Passing these as the prefixes argument of symbolic_apply
+        explores the rest of the schedule tree.
+        """
+
+        if self.remote_pending is not None:
+            return self.remote_pending()
+        return [list(sched.forced) if isinstance(sched, ForcedSchedule)
+                and not sched else [node.token() for node in sched]
+                for sched in self.schedq]
+
+    def path_state(self, sched):
+        """Return a new PathState for following schedule sched."""
+
+        if options.explore == "replay":
+            return PathState(sched, cex_cache=self.cex_cache)
+        if options.explore != "incremental":
+            raise ValueError("Unknown exploration engine %r" % options.explore)
+
+        if self.solver is None:
+            self.solver = z3.Solver()
+        # Pop the solver back to the longest prefix of sched that is
+        # already asserted.  Since schedules are forked by copying the
+        # current schedule, a shared prefix consists of the very same
+        # SchedNode objects.
+        nshared = 0
+        for node in sched:
+            if nshared == len(self.asserted):
+                break
+            if node.typ in ("exception", "note"):
+                continue
+            if node is not self.asserted[nshared]:
+                break
+            nshared += 1
+        if nshared < len(self.asserted):
+            self.solver.pop(len(self.asserted) - nshared)
+            del self.asserted[nshared:]
+            del self.asserted_digests[nshared:]
+        # The previous path's model satisfies its whole path
+        # constraint, so it also satisfies the shared prefix.
+        prev = self.__prev_path_state
+        self.__prev_path_state = PathState(
+            sched, self.solver, self.asserted, prev and prev.model,
+            self.cex_cache, self.asserted_digests)
+        return self.__prev_path_state
 
 class PathState(object):
     """Tracks state for the current symbolic execution code path."""
 
-    def __init__(self, sched):
+    def __init__(self, sched, solver=None, asserted=None, model=None,
+                 cex_cache=None, asserted_digests=None):
         self.sched = sched
         self.schedidx = 0
-        self.solver = z3.Solver()
+        if solver is None:
+            solver = z3.Solver()
+        self.solver = solver
+        # For incremental exploration, the Scheduler's list of
+        # asserted SchedNodes.  The first nconstraints of these are
+        # constraints this path has already reached.
+        self.__asserted = asserted
+        # With a verdict cache, the VerdictCache.digest of each formula
+        # asserted in solver, in order, so query keys can be built
+        # without serializing the solver's assertions.
+        self.query_digests = [] if asserted_digests is None \
+                             else asserted_digests
+        self.nconstraints = 0
+        # The most recent Z3 model satisfying everything asserted in
+        # solver, or None.
+        self.model = model
+        # If cex_cache is a CexCache, the ids of the constraints this
+        # path has reached, interned in cex_cache.
+        self.__cex_cache = cex_cache
+        self.__cex_ids = []
+        # While initial_var declares a variable, a list of the
+        # (expr, added) outcomes of its assumptions (see InitialVar).
+        self.assume_log = None
+        # For the "novel" assume policy, the AST ids of the
+        # constraints on this path.  Z3 hash-conses ASTs, so
+        # structurally identical expressions have the same id.
+        self.constraint_ids = set() if options.assume_policy == "novel" \
+                              else None
+        # If assumptions have been added to this path since its
+        # satisfiability was last checked (see options.assume_policy),
+        # the SchedNode of the last one; otherwise None.  If the path
+        # turns out to be unsatisfiable, this node takes the blame.
+        self.unchecked = None
+        # The schedule position (schedidx) of each assumption this
+        # path found implied, in order, and how many of these were
+        # replayed from "i" tokens (see ForcedSchedule).
+        self.implied = []
+        self.forced_implied = 0
+
+    def add_constraint(self, node, model=None):
+        """Add the path expression of SchedNode node to the solver.
+
+        This must be called in schedule order for every branch and
+        assumption node the path follows.  In incremental exploration,
+        constraints already asserted by an earlier code path with the
+        same schedule prefix are not asserted again.
+
+        If model is provided, it must be a Z3 model satisfying the
+        path constraint with node's path expression added.
+        """
+
+        asserted = self.__asserted
+        idx = self.nconstraints
+        self.nconstraints += 1
+        expr = None
+        if self.__cex_cache is not None or self.constraint_ids is not None:
+            expr = unwrap(node.path_expr())
+        if self.__cex_cache is not None:
+            self.__cex_ids.append(self.__cex_cache.intern(expr))
+        if self.constraint_ids is not None:
+            self.constraint_ids.add(expr.get_id())
+        if asserted is not None:
+            if idx < len(asserted):
+                if asserted[idx] is not node:
+                    raise ReplayDivergedError(asserted[idx], node)
+                return
+            self.solver.push()
+            asserted.append(node)
+        if expr is None:
+            expr = unwrap(node.path_expr())
+        self.solver.add(expr)
+        if options.verdict_cache is not None:
+            self.query_digests.append(options.verdict_cache.digest(expr))
+        if model is not None:
+            self.model = model
+        elif self.eval_model(expr) is not True:
+            self.model = None
+
+    def drop_later_constraints(self):
+        """Pop the constraints the path hasn't reached off the solver.
+
+        In incremental exploration, the solver starts out holding the
+        constraints of the schedule prefix the path shares with the
+        previous path, including ones the path has yet to replay.
+        Checks that must see only the constraints reached so far call
+        this first.  add_constraint asserts the dropped constraints
+        again as the path reaches them.
+        """
+
+        asserted = self.__asserted
+        if asserted is not None and self.nconstraints < len(asserted):
+            self.solver.pop(len(asserted) - self.nconstraints)
+            del asserted[self.nconstraints:]
+            del self.query_digests[self.nconstraints:]
+
+    def eval_model(self, expr):
+        """Evaluate expr in the path's last model.
+
+        Returns True or False if the model settles expr, or None if
+        there is no model or expr depends on values it leaves open.
+        """
+
+        if self.model is None:
+            return None
+        val = self.model.eval(expr)
+        if z3.is_true(val):
+            return True
+        if z3.is_false(val):
+            return False
+        return None
+
+    def check_unchecked(self):
+        """Check the path's satisfiability if assumptions are unchecked.
+
+        Raises UnsatisfiablePath if the "defer" assume policy let the
+        path become unsatisfiable, or UncheckableConstraintError if
+        the solver can't tell.
+        """
+
+        if self.unchecked is None:
+            return
+        res = self.check(z3.BoolVal(True))
+        if res.is_unsat:
+            raise UnsatisfiablePath(self.unchecked)
+        elif res.is_unknown:
+            raise UncheckableConstraintError(z3.BoolVal(True), res.reason)
+        self.unchecked = None
+
+    def check(self, expr):
+        """Check the satisfiability of expr under the path constraint.
+
+        expr is passed to the solver as an assumption, so the solver
+        is left unchanged.  Returns a CheckResult; for a sat result,
+        its model satisfies both the path constraint and expr.
+        """
+
+        stats["branch_checks"] += 1
+        cex = self.__cex_cache
+        if cex is not None:
+            lit = cex.intern(expr)
+            query = frozenset(self.__cex_ids + [lit])
+            res = cex.lookup(query, lit)
+            if res is not None:
+                return res
+        res = cached_query(self.query_digests + [expr],
+                           "branch", lambda: self.__solve(expr),
+                           need_model=True)
+        if cex is not None:
+            cex.add(query, lit, res)
+        return res
+
+    def __solve(self, expr):
+        res = self.solver.check(expr)
+        if res == z3.sat:
+            return CheckResult(res, self.solver.model())
+        elif res == z3.unsat:
+            return CheckResult(res)
+
+        # Slow path.  Assumptions and solver scopes change how Z3
+        # "compiles" formulas (for example, quantifiers in an
+        # assumption aren't preprocessed like asserted quantifiers),
+        # so try asserting expr and then solving it in isolation.
+        stats["branch_slow_checks"] += 1
+        self.solver.push()
+        self.solver.add(expr)
+        res = self.solver.check()
+        if res == z3.sat:
+            model = self.solver.model()
+        self.solver.pop()
+        if res == z3.sat:
+            return CheckResult(res, model)
+        elif res == z3.unsat:
+            return CheckResult(res)
+
+        s2 = z3.Solver()
+        s2.add(*self.solver.assertions())
+        s2.add(expr)
+        res = s2.check()
+        if res == z3.sat:
+            return CheckResult(res, s2.model())
+        elif res == z3.unknown:
+            return CheckResult(res, s2.reason_unknown())
+        return CheckResult(res)
+
+    def replaying(self):
+        """Return True if this path is still replaying its schedule."""
+        return self.schedidx < len(self.sched)
+
+    def forced_token(self):
+        """Return the forced token for a new schedule node, or None.
+
+        This returns None unless the path is at the end of its
+        schedule and the schedule is a ForcedSchedule with tokens
+        left.
+        """
+
+        forced = getattr(self.sched, "forced", ())
+        idx = self.schedidx + self.forced_implied
+        if self.schedidx == len(self.sched) and idx < len(forced):
+            return forced[idx]
+        return None
+
+    def skip_implied(self):
+        """Record that the path's next assumption is implied.
+
+        Returns False, for add_assumption to return.
+        """
+
+        if self.forced_token() == "i":
+            self.forced_implied += 1
+        self.implied.append(self.schedidx)
+        return False
 
     def str_path(self):
         """Return the current path constraint as a string."""
@@ -1215,9 +2312,9 @@ class PathState(object):
                 #note = str(node.path_expr())
             if "\n" in note:
                 note = "\n  " + note.replace("\n", "\n  ")
-            out.append("%s:%s: %s" %
-                       (os.path.basename(node.frames[0].filename),
-                        node.frames[0].lineno, note))
+            filename, lineno = node.location()
+            out.append("%s:%s: %s" % (os.path.basename(filename), lineno,
+                                      note))
         return "\n".join(out)
 
 def note(note):
@@ -1234,29 +2331,78 @@ def note(note):
             raise ReplayDivergedError(node, "note")
     path_state.schedidx += 1
 
+class Simplifier(object):
+    """A memoizing front end to Z3's simplification tactics.
+
+    The tactics are built once and reused, and the results for the
+    most recently simplified expressions are kept in an LRU cache of
+    options.simplify_cache_size entries.  Like CexCache, the cache is
+    keyed by Z3 AST id and holds on to the ASTs so their ids aren't
+    reused.
+    """
+
+    def __init__(self):
+        self.__tactics = {}
+        self.__cache = collections.OrderedDict()
+
+    def __tactic(self, try_harder):
+        t = self.__tactics.get(try_harder)
+        if t is None:
+            core_simplifier = 'ctx-simplify'
+            if try_harder:
+                ## ctx-solver-simplify is very slow; use the
+                ## faster but less powerful ctx-simplify.
+                core_simplifier = 'ctx-solver-simplify'
+            t = z3.Repeat(z3.Then(z3.With('simplify', expand_select_store=True,
+                                                      ite_extra_rules=True,
+                                                      expand_store_eq=True),
+                                  'propagate-values',
+                                  'ctx-simplify',
+                                  core_simplifier,
+                                  ))
+            self.__tactics[try_harder] = t
+        return t
+
+    def simplify(self, expr, try_harder=False):
+        """Return a simplified form of Z3 boolean expression expr."""
+
+        key = (expr.get_id(), try_harder)
+        ent = self.__cache.pop(key, None)
+        if ent is not None:
+            stats["simplify_cache_hits"] += 1
+            self.__cache[key] = ent
+            return ent[1]
+        stats["simplify_cache_misses"] += 1
+
+        subgoals = self.__tactic(try_harder)(expr)
+        if len(subgoals[0]) == 0:
+            res = z3.BoolVal(True)
+        else:
+            res = z3.simplify(unwrap(symand([symand(wraplist(g))
+                                             for g in subgoals])))
+
+        if options.simplify_cache_size > 0:
+            self.__cache[key] = (expr, res)
+            while len(self.__cache) > options.simplify_cache_size:
+                self.__cache.popitem(last=False)
+        return res
+
+    def clear(self):
+        """Forget all cached results and tactics."""
+        self.__cache.clear()
+        self.__tactics.clear()
+
+simplifier = Simplifier()
+# Release the cached Z3 objects while the z3 module is still intact
+atexit.register(simplifier.clear)
+
 def simplify(expr, try_harder=False):
+    """Simplify expr using simplifier."""
+
     expr = unwrap(expr)
     if not z3.is_ast(expr):
         return expr
-    core_simplifier = 'ctx-simplify'
-    if try_harder:
-        ## ctx-solver-simplify is very slow; use the
-        ## faster but less powerful ctx-simplify.
-        core_simplifier = 'ctx-solver-simplify'
-    t = z3.Repeat(z3.Then(z3.With('simplify', expand_select_store=True,
-                                              ite_extra_rules=True,
-                                              expand_store_eq=True),
-                          'propagate-values',
-                          'ctx-simplify',
-                          core_simplifier,
-                          ))
-    subgoals = t(expr)
-    if len(subgoals[0]) == 0:
-        s = wrap(z3.BoolVal(True))
-    else:
-        s = wrap(z3.simplify(unwrap(symand([symand(wraplist(g))
-                                            for g in subgoals]))))
-    return s
+    return wrap(simplifier.simplify(expr, try_harder))
 
 def assume(e):
     """Declare symbolic expression e to be True."""
@@ -1264,26 +2410,98 @@ def assume(e):
     if e is True:
         return
 
+    # initial_var records the outcome of each assumption it declares
+    # and replays these outcomes on later calls.
+    log = Env.path_state().assume_log
+    if log is None:
+        add_assumption(e)
+    else:
+        log.append((e, add_assumption(e)))
+
+def add_assumption(e, checked=False):
+    """Add assumption e to the current path.
+
+    If checked is True, the caller already knows that e is neither
+    implied by the path constraint nor contradicts it, so this skips
+    the solver checks.  Returns True if e was added, or False if it
+    was implied.
+    """
+
     scheduler, path_state = Env.scheduler(), Env.path_state()
+    cursched = path_state.sched
 
     # Is this assumption already implied?  This isn't strictly
     # necessary, but it cleans up generated expressions and the
     # execution graph.  It also sometimes lets z3 decide a path
     # condition that it otherwise can't (which is probably a z3 bug).
     solver = path_state.solver
-    solver.push()
-    solver.add(unwrap(symnot(e)))
-    sat = solver.check()
-    solver.pop()
-    if sat == z3.unsat:
-        return
+    note = unwrap(symnot(e))
+    def check_implied():
+        solver.push()
+        solver.add(note)
+        res = CheckResult(solver.check())
+        solver.pop()
+        return res
+    def implied():
+        if checked:
+            stats["assume_checks_skipped"] += 1
+            return False
+        ids, ast = path_state.constraint_ids, unwrap(e)
+        if ids is not None and z3.is_ast(ast) and ast.get_id() in ids:
+            stats["assume_checks_skipped"] += 1
+            return True
+        stats["assume_checks"] += 1
+        return cached_query(path_state.query_digests + [note], "implied",
+                            check_implied).is_unsat
+
+    forced = path_state.forced_token()
+    if forced is not None:
+        # The token records the outcome of this assumption's checks:
+        # "i" if it was implied, "a" if it was added, "u" if it made
+        # the path unsatisfiable.  Unless the schedule marks implied
+        # assumptions, these leave no token, so any other token means
+        # the assumption was implied and an "a" or "u" may belong to
+        # a later assumption.
+        if forced not in ("a", "u") or \
+           (not path_state.sched.marks_implied and implied()):
+            return path_state.skip_implied()
+        node = SchedNode("assumption", e, True)
+        cursched.append(node)
+        path_state.schedidx += 1
+        path_state.add_constraint(node)
+        if forced == "u":
+            raise UnsatisfiablePath(node)
+        return True
+
+    if options.explore == "incremental" and path_state.replaying():
+        # The schedule records the outcome of this assumption's checks
+        # from when it was first explored.  If it wasn't recorded, it
+        # was implied; otherwise the solver already holds it.
+        node = cursched[path_state.schedidx]
+        if node.typ != "assumption" or not node.expr.eq(e):
+            # The solver may already hold later constraints, which
+            # could imply e
+            path_state.drop_later_constraints()
+            if implied():
+                return path_state.skip_implied()
+            # Check for replay divergence
+            if node.typ != "assumption":
+                raise ReplayDivergedError(node, "assumption")
+            raise ReplayDivergedError(node.expr, e)
+        path_state.schedidx += 1
+        path_state.add_constraint(node)
+        return True
+
+    if implied():
+        return path_state.skip_implied()
 
     # Update the schedule and execution graph.  (We wouldn't need to
     # track assumptions in the schedule except that we want to avoid
     # duplicate nodes in the execution graph.)
-    cursched = path_state.sched
-    if len(cursched) == path_state.schedidx:
-        cursched.append(SchedNode("assumption", e, True))
+    new = len(cursched) == path_state.schedidx
+    if new:
+        node = SchedNode("assumption", e, True)
+        cursched.append(node)
     else:
         # Check for replay divergence
         node = cursched[path_state.schedidx]
@@ -1293,18 +2511,98 @@ def assume(e):
             raise ReplayDivergedError(node.expr, e)
     path_state.schedidx += 1
 
-    solver.add(unwrap(e))
-    sat = solver.check()
-    if sat == z3.unknown:
-        s2 = z3.Solver()
-        s2.add(*solver.assertions())
-        sat = s2.check()
-        reason = s2.reason_unknown()
+    path_state.add_constraint(node)
+    if checked or options.assume_policy == "defer":
+        stats["assume_checks_skipped"] += 1
+        # A replayed assumption was satisfiable when its schedule was
+        # first explored
+        if new and not checked:
+            path_state.unchecked = node
+        return True
+    def check_path():
+        res = solver.check()
+        if res == z3.sat:
+            return CheckResult(res, solver.model())
+        elif res == z3.unknown:
+            s2 = z3.Solver()
+            s2.add(*solver.assertions())
+            res = s2.check()
+            if res == z3.unknown:
+                return CheckResult(res, s2.reason_unknown())
+        return CheckResult(res)
+    stats["assume_checks"] += 1
+    res = cached_query(path_state.query_digests, "path", check_path,
+                       need_model=True)
+
+    if res.is_unsat:
+        raise UnsatisfiablePath(node)
+    elif res.is_unknown:
+        raise UncheckableConstraintError(unwrap(e), res.reason)
+    elif res.z3_model is not None:
+        path_state.model = res.z3_model
+    return True
+
+class InitialVar(object):
+    """A variable declared by initial_var, and what declaring it did.
+
+    value is the variable's compound Z3 value.  var_constructors and
+    const_types are the entries its declaration added to the Env, and
+    anon_names is the number of anonymous names it generated.  entries
+    lists the (expr, added) outcomes of the assumptions it declared,
+    where added indicates whether the assumption was added to the path
+    or was implied.
+    """
+
+    def __init__(self, value, var_constructors, const_types, anon_names,
+                 entries):
+        self.value = value
+        self.var_constructors = var_constructors
+        self.const_types = const_types
+        self.anon_names = anon_names
+        self.entries = entries
+
+def initial_var(cls, name):
+    """Return cls.var(name) for a fresh variable.
+
+    A fresh variable's assumptions constrain only its own constants,
+    so one that isn't implied on some path and is satisfiable there
+    can be added to any path.  The first call for a given variable
+    in a Z3 context declares it as usual and records its value, its
+    declarations and the outcomes of its assumptions in initial_vars.
+    Later calls, on any path of any symbolic_apply, build the variable
+    from that record and add the assumptions that were added without
+    consulting the solver.  Whether an assumption is implied can
+    depend on the path (for example, through uninterpreted functions
+    it shares with earlier constraints, or under the "novel"
+    assume_policy), so the ones that were implied are checked again.
+    """
 
-    if sat == z3.unsat:
-        raise UnsatisfiablePath()
-    elif sat != z3.sat:
-        raise UncheckableConstraintError(unwrap(e), reason)
+    env, path_state = Env.current(), Env.path_state()
+    key = (cls, name, anon_info, env.anon_idx)
+    ivar = initial_vars.get(key)
+    if ivar is None:
+        old_vcs, old_cts = env.var_constructors.copy(), env.const_types.copy()
+        path_state.assume_log = []
+        try:
+            var = cls.var(name)
+        finally:
+            entries, path_state.assume_log = path_state.assume_log, None
+        initial_vars[key] = InitialVar(
+            var._z3_value(),
+            {k: v for k, v in env.var_constructors.iteritems()
+             if k not in old_vcs},
+            {k: v for k, v in env.const_types.iteritems()
+             if k not in old_cts},
+            env.anon_idx - key[3], entries)
+        return var
+
+    env.var_constructors.update(ivar.var_constructors)
+    env.const_types.update(ivar.const_types)
+    env.anon_idx += ivar.anon_names
+    var = cls._wrap_lvalue(LValue(LValueCell(ivar.value)), None)
+    for expr, added in ivar.entries:
+        add_assumption(expr, checked=added)
+    return var
 
 class SymbolicApplyResult(object):
     """The result of a symbolic application.
@@ -1317,6 +2615,7 @@ class SymbolicApplyResult(object):
         self.__var_constructors = env.var_constructors
         self.__const_types = env.const_types
         self.__schedule = env.path_state.sched
+        self.__scheduler = env.scheduler
         self.__internal_vals = None
 
         # XXX Should this include deterministic branches?  We have in
@@ -1411,6 +2710,15 @@ class SymbolicApplyResult(object):
         # Convert to hex
         return "p%0*.x" % ((length + 3) / 4, bitstring)
 
+    def pending_prefixes(self):
+        """Return the schedules symbolic_apply has left to explore.
+
+        This is a list of token lists (see SchedNode.token) that,
+        passed as the prefixes argument of symbolic_apply, resumes
+        exploration after this code path.
+        """
+        return self.__scheduler.pending()
+
     @property
     def internals(self):
         """The list of internal Symbolic values created by this path.
@@ -1438,7 +2746,7 @@ class SymbolicApplyResult(object):
         """
 
         if z3_model is None:
-            z3_model = check(self.path_condition).z3_model
+            z3_model = check(self.path_condition, need_model=True).z3_model
 
         return Model(self.__var_constructors, z3_model)
 
@@ -1480,14 +2788,22 @@ class SymbolicApplyResult(object):
                 raise Exception("Failed to resolve type of %s" % const)
         return rec(outer_type, path)
 
-def symbolic_apply(fn, *args):
+def symbolic_apply(fn, *args, **kwargs):
     """Evaluate fn(*args) under symbolic execution.
 
     This yields a series of SymbolicApplyResult objects; one for each
     distinct code path.  If a code path leads to an uncheckable
     constraint, this returns an exception-type result.
+
+    If the keyword argument prefixes is given, it must be a list of
+    token lists returned by SymbolicApplyResult.pending_prefixes, and
+    only the code paths under these schedule prefixes are explored.
     """
 
+    prefixes = kwargs.pop("prefixes", None)
+    if kwargs:
+        raise TypeError("Unexpected keyword arguments %r" % kwargs.keys())
+
     if Env.current() != Env.global_env:
         raise Exception("Recursive symbolic_apply")
 
@@ -1496,34 +2812,51 @@ def symbolic_apply(fn, *args):
     # code path from the same environment, so snapshot it now.
     root_env = Env(Env.current())
     scheduler = Scheduler()
-    graph = SchedGraph()
+    graph = None
+    if options.sched_graph is not None:
+        graph = SchedGraph(options.sched_graph)
 
-    for cursched in scheduler.schedule_generator():
+    if options.path_workers:
+        schedules = parallel_schedules(fn, args, scheduler, prefixes)
+    else:
+        if prefixes is not None:
+            del scheduler.schedq[:]
+            for prefix in prefixes:
+                scheduler.queue_schedule(ForcedSchedule(prefix))
+        schedules = scheduler.schedule_generator()
+
+    for cursched in schedules:
         old_env = Env.current()
-        path_state = PathState(cursched)
+        path_state = scheduler.path_state(cursched)
         Env(root_env, scheduler, path_state).activate()
         sar = None
         try:
             rv = fn(*args)
+            path_state.check_unchecked()
+            scheduler.strategy.path_done(path_state.sched, rv)
             sar = SymbolicApplyResult("value", rv, Env.current())
-            graph.add_sched(path_state.sched, str(rv))
+            if graph is not None:
+                graph.add_sched(path_state.sched, str(rv))
         except UnsatisfiablePath:
-            graph.add_sched(path_state.sched, "Unsatisfiable path", "blue")
+            if graph is not None:
+                graph.add_sched(path_state.sched, "Unsatisfiable path", "blue")
             raise
         except UncheckableConstraintError as e:
             import traceback
             traceback.print_exc()
             print >>sys.stderr, "Ignoring path with uncheckable constraint"
+            scheduler.strategy.path_done(path_state.sched, None)
             sar = SymbolicApplyResult("exception", sys.exc_info(), Env.current())
-            graph.add_sched(path_state.sched, "Exception: " + str(e), "red")
+            if graph is not None:
+                graph.add_sched(path_state.sched, "Exception: " + str(e), "red")
         except Exception as e:
-            graph.add_sched(path_state.sched, "Exception: " + str(e), "red")
+            if graph is not None:
+                graph.add_sched(path_state.sched, "Exception: " + str(e), "red")
             if len(e.args) == 1:
                 e.args = ('%s in symbolic state:\n%s' %
                           (e.args[0], path_state.str_path()),)
             else:
                 e.args = e.args + (path_state.str_path(),)
-            graph.show()
             raise
         finally:
             old_env.activate()
@@ -1531,7 +2864,206 @@ def symbolic_apply(fn, *args):
         if sar is not None:
             yield sar
 
-#    graph.show()
+# The maximum number of code paths a path worker explores before
+# handing its remaining schedules back to be shared out.
+PATH_WORKER_BUDGET = 16
+
+# The pool of path worker processes, and the queue on which path
+# worker tasks report the process running them (see
+# start_path_workers)
+path_worker_pool = path_worker_started = None
+# Ids for path worker tasks
+path_worker_tasks = itertools.count()
+# The options that path workers keep from when they were started.
+# Tasks carry the calling process's values of the others.
+PATH_WORKER_OWN_OPTIONS = ("verdict_cache", "sched_graph")
+
+# Path worker tasks are sent to the workers by pickling their fn and
+# args, which are usually a model's unbound methods
+def reduce_method(m):
+    return getattr, (m.im_class if m.im_self is None else m.im_self,
+                     m.im_func.__name__)
+copy_reg.pickle(types.MethodType, reduce_method)
+del reduce_method
+
+def start_path_workers():
+    """Start options.path_workers path worker processes.
+
+    The workers are forked, and Z3 can't safely be used in a process
+    forked from one that already used it, so this must be called
+    before creating any Z3 objects.  Symbolic types build their sorts
+    on demand, so they may already be defined.  The workers serve
+    every later symbolic_apply and are stopped at exit.
+    """
+
+    global path_worker_pool, path_worker_started
+    if path_worker_pool is not None:
+        raise RuntimeError("Path workers are already running")
+    # Workers write to this queue directly, rather than through a
+    # feeder thread, so a report isn't lost if the worker dies
+    path_worker_started = multiprocessing.queues.SimpleQueue()
+    path_worker_pool = multiprocessing.Pool(options.path_workers)
+    def stop():
+        path_worker_pool.terminate()
+        path_worker_pool.join()
+    atexit.register(stop)
+
+def process_alive(pid):
+    """Return whether the process pid exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        raise
+    return True
+
+def parallel_schedules(fn, args, scheduler, prefixes=None):
+    """Explore the code paths of fn(*args) in path worker processes.
+
+    This yields a ForcedSchedule for each code path, in the order
+    sequential exploration would visit them.  A path is yielded as
+    soon as no schedule still being explored could precede it.  If
+    prefixes is not None, explore only below these token lists.
+    """
+
+    if path_worker_pool is None:
+        raise RuntimeError("options.path_workers is set, but the path "
+                           "workers weren't started (start_path_workers)")
+    nworkers = options.path_workers
+    # The workers explore from the root, not our scheduler
+    del scheduler.schedq[:]
+
+    opts = {name: val for name, val in vars(options).iteritems()
+            if not name.startswith("_")
+            and name not in PATH_WORKER_OWN_OPTIONS}
+    results = Queue.Queue()
+    if prefixes is None:
+        prefixes = [[]]
+    pending = [(token_order(prefix), prefix) for prefix in prefixes]
+    heapq.heapify(pending)
+    # Maps from the ids of the tasks handed out to their prefixes and
+    # to the processes running them, once they've started
+    running, pids = {}, {}
+    paths = []
+    # A path that has been handed out but not yielded still has to be
+    # explored if we're resumed.
+    scheduler.remote_pending = lambda: (
+        [prefix for _, prefix in pending] + running.values() +
+        [tokens for _, tokens in paths])
+    while pending or running or paths:
+        # Hand out subtrees, earliest first.  If there isn't enough
+        # work to go around, ask for it back after one path.
+        while pending and len(running) < nworkers:
+            key, prefix = heapq.heappop(pending)
+            budget = PATH_WORKER_BUDGET
+            if len(pending) + len(running) < nworkers:
+                budget = 1
+            task = next(path_worker_tasks)
+            running[task] = prefix
+            path_worker_pool.apply_async(
+                path_worker, (fn, args, opts, prefix, budget, task),
+                callback=lambda res, task=task: results.put((task, res)))
+
+        # Yield the paths that nothing outstanding can precede
+        bound = min(map(token_order, running.values()) +
+                    [key for key, _ in pending] or [None])
+        while paths and (bound is None or paths[0][0] < bound):
+            yield ForcedSchedule(heapq.heappop(paths)[1],
+                                 marks_implied=True)
+            if scheduler.schedq:
+                raise ReplayDivergedError(
+                    scheduler.schedq[-1][-1], "end of schedule")
+        if not running:
+            continue
+
+        # Wait for a worker.  Poll, so that Python can deliver
+        # KeyboardInterrupt, and so that we notice when a worker dies
+        # (say, killed for running out of memory) and the result of
+        # its task will never come.
+        while True:
+            try:
+                task, (status, res) = results.get(True, 1)
+                break
+            except Queue.Empty:
+                pass
+            while not path_worker_started.empty():
+                started, pid = path_worker_started.get()
+                if started in running:
+                    pids[started] = pid
+            for started, pid in pids.iteritems():
+                if not process_alive(pid):
+                    raise RuntimeError(
+                        "Path worker %d exited while exploring below %r" %
+                        (pid, running[started]))
+        del running[task]
+        pids.pop(task, None)
+        if status == "error":
+            raise RuntimeError("Exception in path worker:\n" + res)
+        newpaths, newpending, worker_stats = res
+        stats.update(worker_stats)
+        for tokens in newpaths:
+            heapq.heappush(paths, (token_order(tokens), tokens))
+        for prefix in newpending:
+            heapq.heappush(pending, (token_order(prefix), prefix))
+
+def path_worker(fn, args, opts, prefix, budget, task):
+    """Explore the schedule subtree under prefix in a path worker.
+
+    This explores up to budget code paths of fn(*args) below the
+    schedule recorded by the list of tokens prefix, with the options
+    in the dict opts, after reporting that this process runs task on
+    path_worker_started.  It returns ("ok", (paths, pending, stats)), where paths and pending are token lists for the explored
+    code paths and the unexplored subtrees and stats is this task's
+    contribution to simsym.stats.  The token lists of paths mark
+    implied assumptions (see ForcedSchedule).  If exploration fails,
+    it returns ("error", traceback).
+    """
+
+    def path_tokens(path_state, unsat=None):
+        tokens = ["u" if n is unsat else n.token() for n in path_state.sched]
+        for pos in reversed(path_state.implied):
+            tokens.insert(pos, "i")
+        return tokens
+
+    path_worker_started.put((task, os.getpid()))
+    for name, val in opts.iteritems():
+        setattr(options, name, val)
+    try:
+        root_env = Env(Env.global_env)
+        start_stats = stats.copy()
+        scheduler = Scheduler()
+        scheduler.schedq[:] = [ForcedSchedule(prefix)]
+        paths = []
+        for cursched in scheduler.schedule_generator():
+            old_env = Env.current()
+            path_state = scheduler.path_state(cursched)
+            Env(root_env, scheduler, path_state).activate()
+            try:
+                rv = fn(*args)
+                path_state.check_unchecked()
+                scheduler.strategy.path_done(path_state.sched, rv)
+            except UncheckableConstraintError:
+                scheduler.strategy.path_done(path_state.sched, None)
+            except UnsatisfiablePath as e:
+                # The calling process will re-raise this when it
+                # re-runs the path.
+                paths.append(path_tokens(path_state, e.node))
+                break
+            except Exception:
+                # The calling process will re-raise this when it
+                # re-runs the path.
+                paths.append(path_tokens(path_state))
+                break
+            finally:
+                old_env.activate()
+            paths.append(path_tokens(path_state))
+            if len(paths) >= budget:
+                break
+        pending = [[n.token() for n in sched] for sched in scheduler.schedq]
+        return "ok", (paths, pending, stats - start_stats)
+    except Exception:
+        return "error", traceback.format_exc()
 
 class CheckResult(object):
     def __init__(self, z3_result, extra=None):
@@ -1545,6 +3077,8 @@ class CheckResult(object):
     @property
     def z3_model(self):
         if self.is_sat:
+            if callable(self.__extra):
+                self.__extra = self.__extra()
             return self.__extra
         raise ValueError("%s result has no model" % self.result)
 
@@ -1554,15 +3088,508 @@ class CheckResult(object):
             return self.__extra
         raise ValueError("%s result has no unknown reason" % self.result)
 
-def check(e):
-    solver = z3.Solver()
-    solver.add(unwrap(e))
-    c = solver.check()
-    if c == z3.sat:
-        return CheckResult(c, solver.model())
-    elif c == z3.unknown:
-        return CheckResult(c, solver.reason_unknown())
-    return CheckResult(c)
+def cached_query(formulas, kind, solve, need_model=False):
+    """Return solve(), consulting options.verdict_cache.
+
+    solve must return the CheckResult of checking the conjunction of
+    the Z3 formulas in formulas; kind names how solve poses the query
+    (see VerdictCache.key).  formulas may also contain the digests of
+    formulas (see VerdictCache.digest) in their place.  On a cache hit,
+    solve is not called and a sat result has no model.  If need_model
+    is True, sat verdicts are not answered from the cache, since solve
+    would have to be called for the model anyway; they are still
+    recorded for queries that don't need the model.
+    """
+
+    cache = options.verdict_cache
+    if cache is None:
+        return solve()
+    key = cache.key(formulas, kind)
+    hit = cache.get(key)
+    if hit is not None and not (need_model and hit[0] == z3.sat):
+        stats["verdict_cache_hits"] += 1
+        return CheckResult(*hit)
+    stats["verdict_cache_misses"] += 1
+    if hit is not None:
+        stats["verdict_cache_model_misses"] += 1
+    start = time.time()
+    res = solve()
+    if hit is not None:
+        # Already recorded
+        pass
+    elif time.time() - start < cache.min_time:
+        stats["verdict_cache_uncached"] += 1
+    else:
+        cache.put(key, res.z3_result, res.reason if res.is_unknown else None)
+    return res
+
+def check(e, need_model=False):
+    """Return the CheckResult of e.
+
+    With a verdict cache, a sat result has a model only if need_model
+    is True (see cached_query).
+    """
+
+    e = unwrap(e)
+    def solve():
+        solver = z3.Solver()
+        solver.add(e)
+        c = solver.check()
+        if c == z3.sat:
+            return CheckResult(c, solver.model())
+        elif c == z3.unknown:
+            return CheckResult(c, solver.reason_unknown())
+        return CheckResult(c)
+    return cached_query([e], "check", solve, need_model)
+
+class FreeVars(object):
+    """Memoized analysis of the uninterpreted constants in Z3 terms.
+
+    Terms are traversed as DAGs and the results for every subterm are
+    cached by AST id, so subterms shared within a term or between
+    terms (such as the Store and Select chains of path conditions) are
+    only visited once.  Besides the constants of a term, this finds
+    what decides whether two conjuncts are independent (see
+    independence).  The cache keeps the visited ASTs alive so their
+    ids stay valid; clear it when they are no longer needed.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Maps from AST id to (AST, tuple of frozensets of ids)
+        self.__cache = {}
+        self.__infos = {}
+        # Map from uninterpreted function declaration id to declaration
+        self.__decls = {}
+
+    def __fold(self, cache, expr, own):
+        """Return the union of own(e) over the subterms e of expr.
+
+        own must return a tuple of frozensets; the union is taken
+        element-wise and cached in cache for each subterm.
+        """
+
+        todo = [expr]
+        while todo:
+            e = todo[-1]
+            eid = e.get_id()
+            if eid in cache:
+                todo.pop()
+                continue
+            children = e.children()
+            pending = [c for c in children if c.get_id() not in cache]
+            if pending:
+                todo.extend(pending)
+                continue
+            todo.pop()
+            res = []
+            for sets in zip(own(e), *[cache[c.get_id()][1]
+                                      for c in children]):
+                # Share the largest set when it covers the others,
+                # which is the common case in long chains
+                big = max(sets, key=len)
+                if any(not s.issubset(big) for s in sets):
+                    big = big.union(*sets)
+                res.append(big)
+            cache[eid] = (e, tuple(res))
+        return cache[expr.get_id()][1]
+
+    def __const(self, e):
+        if z3.is_const(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+            return (frozenset([e.get_id()]),)
+        return (frozenset(),)
+
+    def ids(self, expr):
+        """Return a frozenset of the ids of the uninterpreted
+        constants in expr."""
+
+        expr = unwrap(expr)
+        if not z3.is_ast(expr):
+            return frozenset()
+        return self.__fold(self.__cache, expr, self.__const)[0]
+
+    def __info(self, e):
+        syms, sorts, bounding = set(), set(), set()
+        def note_sort(sort, bound):
+            kind = sort.kind()
+            if kind == z3.Z3_UNINTERPRETED_SORT:
+                sorts.add(sort.get_id())
+                if bound:
+                    bounding.add(sort.get_id())
+            elif kind == z3.Z3_ARRAY_SORT:
+                note_sort(sort.domain(), True)
+                note_sort(sort.range(), bound)
+        if z3.is_quantifier(e):
+            for i in range(e.num_vars()):
+                note_sort(e.var_sort(i), True)
+        else:
+            note_sort(e.sort(), False)
+            if z3.is_app(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                decl = e.decl()
+                self.__decls[decl.get_id()] = decl
+                syms.add(decl.get_id())
+        return frozenset(syms), frozenset(sorts), frozenset(bounding)
+
+    def independence(self, expr):
+        """Return the uninterpreted symbols of Z3 term expr, the
+        uninterpreted sorts it mentions, and the sorts whose size it
+        may bound.
+
+        Symbols (constants and functions) are given by the ids of
+        their declarations and sorts by their ids, in frozensets.  A
+        quantifier over a sort, or an array indexed by it, can bound
+        its size.  Conjuncts that share none of these are independent
+        (see simsym.Slicer and simsym.Enumerator).
+        """
+
+        return self.__fold(self.__infos, expr, self.__info)
+
+    def decl(self, decl_id):
+        """Return the declaration of a symbol found by independence."""
+        return self.__decls[decl_id]
+
+# The free-variable analysis shared by Slicer, Enumerator and
+# ComponentModel.  Test generation shares it too and clears it at the
+# start of each code path (see spec.TestWriter).
+free_vars = FreeVars()
+# Release the cached Z3 objects while the z3 module is still intact
+atexit.register(free_vars.clear)
+
+class ComponentModel(object):
+    """A model of a conjunction pieced together from the models of its
+    independent components.
+
+    parts must be a list of (keys, z3_model) pairs, one for each
+    component, where keys are the component's uninterpreted symbols
+    (see FreeVars.independence), plus ("sort",) if it mentions any
+    uninterpreted sort.  No two components may share a key, so values
+    of uninterpreted sorts all come from one model.
+
+    Like a Z3 model, this evaluates expressions.  An expression that
+    mixes components is evaluated bottom up, by substituting the
+    values of the operands that belong to other components.  Symbols
+    that no component mentions belong to the component with the
+    uninterpreted sorts if their signature has one, or else to the
+    first component, so that model completion gives them one value.
+    """
+
+    def __init__(self, parts):
+        self.__models = [z3_model for _, z3_model in parts]
+        self.__owner = {key: i for i, (keys, _) in enumerate(parts)
+                        for key in keys}
+
+    def __part(self, decl):
+        """Return the component of uninterpreted declaration decl."""
+        i = self.__owner.get(decl.get_id())
+        if i is not None:
+            return i
+        sorts = [decl.domain(j) for j in range(decl.arity())] + [decl.range()]
+        while sorts:
+            sort = sorts.pop()
+            if sort.kind() == z3.Z3_ARRAY_SORT:
+                sorts.extend([sort.domain(), sort.range()])
+            elif sort.kind() == z3.Z3_UNINTERPRETED_SORT:
+                return self.__owner.get(("sort",), 0)
+        return 0
+
+    def __parts(self, expr):
+        """Return the set of components whose symbols expr uses."""
+        syms, _, _ = free_vars.independence(expr)
+        return set(self.__part(free_vars.decl(sym)) for sym in syms)
+
+    def evaluate(self, expr, model_completion=False):
+        expr = unwrap(expr)
+        parts = self.__parts(expr)
+        if len(parts) <= 1:
+            return self.__models[min(parts or [0])].evaluate(
+                expr, model_completion)
+
+        # Array values (which can refer to functions in their model)
+        # and values of uninterpreted sorts only mean something in
+        # their own model.  Subterms of other sorts can be replaced by
+        # their values, so evaluate the largest such subterms first,
+        # and the rest in the component of the symbols it has left.
+        def portable(e):
+            return e.sort().kind() not in (z3.Z3_UNINTERPRETED_SORT,
+                                           z3.Z3_ARRAY_SORT)
+        target, subst, seen = set(), [], set()
+        todo = [expr]
+        while todo:
+            e = todo.pop()
+            if e.get_id() in seen:
+                continue
+            seen.add(e.get_id())
+            if e is not expr and portable(e):
+                subst.append(e)
+                continue
+            if z3.is_quantifier(e):
+                raise ValueError("Cannot evaluate %s across components" %
+                                 expr)
+            if z3.is_app(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                target.add(self.__part(e.decl()))
+            todo.extend(e.children())
+        if len(target) > 1:
+            raise ValueError("Cannot evaluate %s across components" % expr)
+        subst = [(e, self.evaluate(e, model_completion)) for e in subst
+                 if not self.__parts(e) <= target]
+        return self.evaluate(z3.substitute(expr, *subst), model_completion)
+
+    eval = evaluate
+
+    def sexpr(self):
+        return "".join(m.sexpr() for m in self.__models)
+
+class Enumerator(object):
+    """Enumerates the models of a formula.
+
+    The caller alternates between check, to get a model, and block,
+    to add a constraint (typically the negation of that model) before
+    asking for the next one.  The conjunction of the original formula
+    and the blocking constraints so far is available as formula.
+
+    By default, each check solves formula from scratch, like check.
+    An incremental Enumerator instead keeps one solver, asserts the
+    original formula once and adds each blocking constraint to it, so
+    each check builds on the solver's work from the previous ones.
+    The incremental solver can give up on queries that the
+    non-incremental one handles, so an unknown result is retried from
+    scratch.  The two solvers also tend to produce different models.
+
+    If options.slice_checks is set, checks from scratch split formula
+    into independent groups of conjuncts (conjuncts that share no
+    uninterpreted symbols; see FreeVars.independence).  A group that an
+    earlier check already solved keeps its model, and only the other
+    groups go to the solver.  The model of formula is then a
+    ComponentModel.  For the models to combine, all conjuncts that
+    mention uninterpreted sorts form one group.  Blocking constraints
+    tie together the groups they mention, so this saves the most on
+    the groups they leave alone.
+    """
+
+    def __init__(self, e, incremental=False):
+        self.formula = e
+        self.__solver = None
+        if incremental:
+            self.__solver = z3.Solver()
+            self.__solver.add(unwrap(e))
+        # For sliced checks, the conjuncts of formula and their
+        # independence info, and the results of solving groups of
+        # conjuncts, keyed by the tuple of their AST ids
+        self.__conjuncts = self.__infos = None
+        if options.slice_checks:
+            self.__conjuncts, self.__infos = [], []
+            self.__add_conjuncts(e)
+            self.__group_results = {}
+        # The number of solver queries made by check
+        self.nchecks = 0
+
+    def __add_conjuncts(self, e):
+        """Add the conjuncts of e and their independence info to those
+        of formula."""
+        conjuncts, infos = self.__conjuncts, self.__infos
+        todo = [unwrap(e)]
+        while todo:
+            e = todo.pop()
+            if isinstance(e, bool):
+                e = z3.BoolVal(e)
+            if z3.is_and(e):
+                todo.extend(reversed(e.children()))
+            else:
+                conjuncts.append(e)
+                infos.append(free_vars.independence(e))
+
+    def block(self, e):
+        """Add constraint e to formula."""
+        self.formula = symand([self.formula, e])
+        if self.__conjuncts is not None:
+            self.__add_conjuncts(e)
+        if self.__solver is not None:
+            e = unwrap(e)
+            if isinstance(e, bool):
+                e = z3.BoolVal(e)
+            self.__solver.add(e)
+
+    def check(self):
+        """Return the CheckResult of formula."""
+        if self.__solver is not None:
+            self.nchecks += 1
+            c = self.__solver.check()
+            if c == z3.sat:
+                return CheckResult(c, self.__solver.model())
+            elif c == z3.unsat:
+                return CheckResult(c)
+        if self.__conjuncts is not None:
+            return self.__check_sliced()
+        self.nchecks += 1
+        return check(self.formula, need_model=True)
+
+    def __check_sliced(self):
+        """Check formula from scratch, reusing the models of
+        independent groups of conjuncts that earlier checks solved."""
+        conjuncts, infos = self.__conjuncts, self.__infos
+
+        # Union-find over conjunct indexes
+        parent = range(len(conjuncts))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        def keys(i):
+            syms, sorts, _ = infos[i]
+            return list(syms) + ([("sort",)] if sorts else [])
+        owner = {}
+        for i in range(len(conjuncts)):
+            for key in keys(i):
+                parent[find(i)] = find(owner.setdefault(key, i))
+        groups = collections.OrderedDict()
+        for i in range(len(conjuncts)):
+            groups.setdefault(find(i), []).append(i)
+
+        # Solve the groups that earlier checks haven't, together
+        stats["sliced_checks"] += 1
+        results, unsolved = [], []
+        for group in groups.itervalues():
+            key = tuple(conjuncts[i].get_id() for i in group)
+            ent = self.__group_results.get(key)
+            if ent is not None:
+                stats["sliced_model_hits"] += 1
+            else:
+                unsolved.append((key, group))
+            results.append((group, ent and ent[1]))
+        if unsolved:
+            self.nchecks += 1
+            res = check(symand(wraplist([conjuncts[i] for _, group in unsolved
+                                         for i in group])), need_model=True)
+            if not res.is_sat:
+                return res
+            for key, group in unsolved:
+                # Hold on to the conjuncts so their ids aren't reused
+                self.__group_results[key] = (
+                    [conjuncts[i] for i in group], res)
+            results = [(group, r or res) for group, r in results]
+
+        # Groups solved together share a model
+        parts = collections.OrderedDict()
+        for group, res in results:
+            parts.setdefault(id(res), (res, set()))[1].update(
+                k for i in group for k in keys(i))
+        if len(parts) == 1:
+            return parts.values()[0][0]
+        return CheckResult(z3.sat, lambda: ComponentModel(
+            [(keys, res.z3_model) for res, keys in parts.itervalues()]))
+
+class Slicer(object):
+    """Checks extensions of satisfiable conjunctions by slicing.
+
+    If base is satisfiable, then base & extra is satisfiable exactly
+    when extra is satisfiable together with the conjuncts of base that
+    are connected to extra through shared uninterpreted constants and
+    functions; the rest of base can be satisfied independently.  The
+    partition of base's conjuncts into independent components is
+    computed once and reused for the checks of any number of extras
+    against the same base.
+
+    Uninterpreted sorts can also connect conjuncts: a quantifier over
+    a sort, or an array indexed by it, can bound how many values the
+    sort has, which constrains every other conjunct that uses the
+    sort.  Conjuncts that mention such a sort are kept together.
+    """
+
+    def __init__(self):
+        self.__base = None
+
+    def __partition(self, bounding):
+        """Return a map from symbols and sorts to the index of the
+        component of base's conjuncts that uses them."""
+
+        part = self.__parts.get(bounding)
+        if part is not None:
+            return part
+        # Union-find over conjunct indexes
+        parent = range(len(self.__conjuncts))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        owner = {}
+        for i, (syms, sorts, _) in enumerate(self.__infos):
+            for key in list(syms) + [("sort", s) for s in sorts & bounding]:
+                j = owner.setdefault(key, i)
+                parent[find(i)] = find(j)
+        part = ({key: find(i) for key, i in owner.iteritems()},
+                map(find, range(len(self.__conjuncts))))
+        self.__parts[bounding] = part
+        return part
+
+    def slice(self, base, extra):
+        """Return the conjuncts of base that must be checked together
+        with extra, assuming base is satisfiable."""
+
+        base, extra = unwrap(base), unwrap(extra)
+        if not z3.is_ast(base):
+            base = z3.BoolVal(base)
+        if self.__base is None or not self.__base.eq(base):
+            self.__base = base
+            self.__conjuncts = []
+            def flatten(e):
+                if z3.is_and(e):
+                    for child in e.children():
+                        flatten(child)
+                else:
+                    self.__conjuncts.append(e)
+            flatten(base)
+            self.__infos = map(free_vars.independence, self.__conjuncts)
+            self.__bounding = frozenset().union(
+                *[bounding for _, _, bounding in self.__infos])
+            self.__parts = {}
+
+        if not z3.is_ast(extra):
+            return []
+        syms, sorts, bounding = free_vars.independence(extra)
+        bounding = self.__bounding | bounding
+        owner, comps = self.__partition(bounding)
+        keep = set()
+        for key in list(syms) + [("sort", s) for s in sorts & bounding]:
+            if key in owner:
+                keep.add(owner[key])
+        return [c for c, comp in zip(self.__conjuncts, comps) if comp in keep]
+
+    def check(self, base, extra):
+        """Return the CheckResult of the conjunction of the lists of
+        expressions base and extra, where the conjunction of base is
+        known to be satisfiable.
+
+        Unless conjuncts are sliced away, the query is the same as
+        check(symand(base + extra)).  A sat result's model only covers
+        the conjuncts that were checked.
+        """
+
+        if not options.slice_checks:
+            return check(symand(base + extra))
+        conjuncts = self.slice(symand(base), symand(extra))
+        stats["sliced_checks"] += 1
+        if len(conjuncts) == len(self.__conjuncts):
+            return check(symand(base + extra))
+        stats["sliced_conjuncts"] += len(self.__conjuncts) - len(conjuncts)
+        return check(symand(wraplist(conjuncts) + extra))
+
+    def clear(self):
+        """Forget the cached partition."""
+        self.__base = self.__conjuncts = self.__infos = self.__parts = None
+
+slicer = Slicer()
+# Release the cached Z3 objects while the z3 module is still intact
+atexit.register(slicer.clear)
+
+def check_sliced(base, extra):
+    """Return the CheckResult of the conjunction of the lists base and
+    extra, where the conjunction of base is known to be satisfiable.
+    See Slicer."""
+    return slicer.check(base, extra)
 
 class Model(object):
     """A Model interprets symbolic expressions into concrete values.
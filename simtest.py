@@ -65,7 +65,7 @@ def test(base, *calls):
     args = []
     for callidx, call in enumerate(calls):
         arg_name = '%s.%s' % (callseq_name([callidx]), call.__name__)
-        args.append(call.arg_struct_type.var(arg_name))
+        args.append(simsym.initial_var(call.arg_struct_type, arg_name))
 
     # op_states[op_index] is a list of pairs of before and after
     # states for operation op_index.
@@ -73,7 +73,7 @@ def test(base, *calls):
 
     # Mapping from frozenset of call indexes to a pair of (callseq,
     # state after callseq).  Prepare with initial state.
-    init = base.var(base.__name__)
+    init = simsym.initial_var(base, base.__name__)
     perm_states = {frozenset([]): ([], init)}
 
     # Mapping from callidx to pair of (callseq ending in callidx,
@@ -163,6 +163,46 @@ def test(base, *calls):
                        for callidx in range(len(calls))],
                       op_states)
 
+class CommutativeFirstStrategy(simsym.Strategy):
+    """A scheduling strategy that looks for commutative paths first.
+
+    For each branch decision (the branch's source location and
+    direction), this tracks how many of the finished code paths that
+    made that decision SIM-commute.  It explores next the queued
+    schedule whose forking decision has the best (smoothed) rate of
+    commutative paths so far, preferring the most recently queued
+    schedule on ties, like depth-first search.  Forced schedules
+    queued on resume don't know their forking decision until they are
+    replayed, so they get the rate of a decision with no paths yet.
+    """
+
+    def __init__(self):
+        # Map from (location, val) to [commutative paths, paths]
+        self.__counts = collections.defaultdict(lambda: [0, 0])
+
+    def __score(self, sched):
+        if not sched:
+            return 0.5
+        node = sched[-1]
+        ncom, npaths = self.__counts[(node.location(), node.val)]
+        return (ncom + 1.0) / (npaths + 2)
+
+    def pick(self, schedq):
+        if len(schedq) == 1 or not schedq[-1]:
+            return len(schedq) - 1
+        return max(reversed(xrange(len(schedq))),
+                   key=lambda i: self.__score(schedq[i]))
+
+    def path_done(self, sched, value):
+        commutative = value is not None and not value.diverge
+        for node in sched:
+            if node.typ == "branch_nondet":
+                counts = self.__counts[(node.location(), node.val)]
+                counts[0] += commutative
+                counts[1] += 1
+
+simsym.strategies["commutative-first"] = CommutativeFirstStrategy
+
 class ExecutionMonitorBase(object):
     """Base class for model execution monitoring."""
 
@@ -208,6 +248,22 @@ class ExecutionMonitorBase(object):
         """
         pass
 
+    def get_checkpoint(self):
+        """Return the progress of the current call set.
+
+        This is called between code paths and must return a
+        JSON-serializable value.  If testing is interrupted, the model
+        executor can resume this call set by calling begin_call_set
+        followed by restore_checkpoint with this value.
+
+        The default implementation returns None.
+        """
+        return None
+
+    def restore_checkpoint(self, state):
+        """Restore call set progress returned by get_checkpoint."""
+        pass
+
     def end_call_set(self):
         """Handle the end of a call set."""
         self.__callset = None
@@ -226,9 +282,17 @@ class StatMonitor(ExecutionMonitorBase):
     def __init__(self):
         super(StatMonitor, self).__init__()
         self.npath = self.ncompath = 0
+        self.__stats = simsym.stats.copy()
 
     def get_progress_format(self):
-        return '{0.npath} paths ({0.ncompath} commutative)'
+        return '{0.npath} paths ({0.ncompath} commutative, ' \
+            '{0.nsaved} branch checks saved)'
+
+    @property
+    def nsaved(self):
+        """The number of branch solver queries avoided by simsym."""
+        return sum(simsym.stats[k] - self.__stats[k]
+                   for k in ('branch_checks_skipped', 'branch_model_hits'))
 
     def on_path(self, result):
         super(StatMonitor, self).on_path(result)
@@ -236,6 +300,12 @@ class StatMonitor(ExecutionMonitorBase):
         if result.type == 'value' and len(result.value.diverge) == 0:
             self.ncompath += 1
 
+    def get_checkpoint(self):
+        return {'npath': self.npath, 'ncompath': self.ncompath}
+
+    def restore_checkpoint(self, state):
+        self.npath, self.ncompath = state['npath'], state['ncompath']
+
 class MetaMonitor(ExecutionMonitorBase):
     def __init__(self, monitors):
         self._monitors = monitors
@@ -256,6 +326,13 @@ class MetaMonitor(ExecutionMonitorBase):
         for m in self._monitors:
             m.on_path(result)
 
+    def get_checkpoint(self):
+        return [m.get_checkpoint() for m in self._monitors]
+
+    def restore_checkpoint(self, state):
+        for m, mstate in zip(self._monitors, state):
+            m.restore_checkpoint(mstate)
+
     def end_call_set(self):
         for m in self._monitors:
             m.end_call_set()
@@ -302,7 +379,8 @@ def print_cond(msg, cond, check_conds, print_conds):
     print '  %s: %s' % (msg, s)
 
 def test_callset(base, callset, monitors,
-                 check_conds=False, print_conds=False):
+                 check_conds=False, print_conds=False,
+                 resume=None, checkpoint=None):
     """Test the SIM-commutativity of a call set.
 
     base must be a class type for the system state.  calls must be the
@@ -316,12 +394,24 @@ def test_callset(base, callset, monitors,
     sat/unsat and report this.  If print_conds is true, print
     commutativity conditions.  If print_conds is "simplify", use
     ctx-solver-simplify to further simplify conditions.
+
+    If checkpoint is not None, it will be called after each code path
+    with a function that returns the progress of this call set as a
+    JSON-serializable value.  If resume is not None, it must be such a
+    value from an earlier, interrupted test of this call set, and
+    testing will continue from where that left off.  Since the path
+    conditions of earlier code paths are lost, this does not report
+    commutativity conditions for a resumed call set.
     """
 
     monitor = MetaMonitor([StatMonitor()] + monitors)
 
     print ' '.join([c.__name__ for c in callset])
     monitor.begin_call_set(callset)
+    prefixes = None
+    if resume is not None:
+        monitor.restore_checkpoint(resume['monitors'])
+        prefixes = map(simsym.unpack_tokens, resume['pending'])
     
     reporter = progress.ProgressReporter(
         '  ' + monitor.get_progress_format(), monitor)
@@ -330,7 +420,8 @@ def test_callset(base, callset, monitors,
     terminated = False
     diverged = set()
     all_internals = []
-    for sar in simsym.symbolic_apply(test, base, *callset):
+    for sar in simsym.symbolic_apply(test, base, *callset,
+                                     prefixes=prefixes):
         if sar.type == 'value':
             is_commutative = (len(sar.value.diverge) == 0)
             diverged.update(sar.value.diverge)
@@ -340,6 +431,10 @@ def test_callset(base, callset, monitors,
         if monitor.stop_call_set():
             terminated = True
             break
+        if checkpoint:
+            checkpoint(lambda: {
+                'pending': map(simsym.pack_tokens, sar.pending_prefixes()),
+                'monitors': monitor.get_checkpoint()})
 
     monitor.end_call_set()
     reporter.end()
@@ -347,6 +442,9 @@ def test_callset(base, callset, monitors,
     if terminated:
         print '  enumeration incomplete; skipping conditions'
         return
+    if resume is not None:
+        print '  resumed mid call set; skipping conditions'
+        return
 
     conds = collections.defaultdict(lambda: [simsym.wrap(z3.BoolVal(False))])
     for result, condlist in condlists.items():
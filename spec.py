@@ -15,6 +15,11 @@ import json
 import testgen
 import traceback
 import importlib
+import verdictcache
+import graph
+import errno
+import time
+import resource
 
 # A test module must have the following two attributes:
 #
@@ -26,29 +31,6 @@ import importlib
 #   model.  It should subclass and implement testgen.TestGenerator.
 #   If this attribute is not present, tests cannot be generated.
 
-def expr_vars(e):
-    """Return an AstSet of uninterpreted constants in e.
-
-    Uninterpreted constants are what people normally think of as
-    "variables".  This is in contrast with interpreted constants such
-    as the number 2.  Note that this will also return values that
-    belong to universes of uninterpreted sorts, since there is no
-    distinguishable difference between these and other uninterpreted
-    constants.
-    """
-
-    res = z3util.AstSet()
-    def rec(e):
-        if not z3.is_ast(e):
-            return
-        if z3.is_const(e) and e.decl().kind() == z3.Z3_OP_UNINTERPRETED:
-            res.add(e)
-            return
-        for child in e.children():
-            rec(child)
-    rec(simsym.unwrap(e))
-    return res
-
 class IsomorphicMatch(object):
     """Construct an expression that matches isomorphisms of a set of conditions.
 
@@ -160,7 +142,7 @@ def idempotent_projs(result, iso_constraint=True):
     pc = result.path_condition
     unknown_count = [0]
     def xcheck(cond):
-        check = simsym.check(simsym.symand([pc, iso_constraint, cond]))
+        check = simsym.check_sliced([pc, iso_constraint], [cond])
         if check.is_unknown:
             if unknown_count[0] == 0:
                 print '  Idempotence unknown:', check.reason
@@ -224,29 +206,85 @@ def idempotent_projs(result, iso_constraint=True):
         res.append(idem_projs)
     return res, unknown_count[0]
 
+def peak_rss():
+    """Return the peak resident set size of this process in KiB.
+
+    This is the peak since the last successful reset_peak_rss, or
+    over the life of the process.
+    """
+
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Reset the peak resident set size to the current one.
+
+    This requires Linux's /proc/self/clear_refs.  Return None if the
+    reset worked, or else a string saying why it didn't.
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except IOError as e:
+        return str(e)
+    return None
+
 class TestWriter(simtest.ExecutionMonitorBase):
-    def __init__(self, trace_file, model_file, test_file, testgen):
+    def __init__(self, trace_file, model_file, test_file, testgen,
+                 resume=None):
         super(TestWriter, self).__init__()
         if isinstance(trace_file, basestring):
-            trace_file = open(trace_file, 'w')
+            if resume is not None:
+                # Drop anything written after the checkpoint
+                trace_file = open(trace_file, 'r+')
+                trace_file.truncate(resume['trace_file_size'])
+                trace_file.seek(0, 2)
+            else:
+                trace_file = open(trace_file, 'w')
         self.trace_file, self.model_file, self.test_file \
             = trace_file, model_file, test_file
         if test_file and testgen:
-            self.testgen = testgen(test_file)
+            self.testgen = testgen(test_file,
+                                   resume and resume.get('testgen'))
         else:
             self.testgen = None
 
+        # Uninterpreted constants of the current path's terms.  This
+        # is shared with simsym's slicing, so it's cleared per path.
+        self.free_vars = simsym.free_vars
+
         # model_data schema:
-        #   root     -> {'tests': {callsetname: {pathid: pathinfo}}}
+        #   root     -> {'tests': {callsetname: {pathid: pathinfo}},
+        #                'peak_rss': {callsetname: KiB},
+        #                'peak_rss_error'?: {callsetname: string}}
+        #     'peak_rss' gives the process's peak RSS at the end of
+        #     each call set.  With --call-set-peak-rss, the peak is
+        #     reset at the start of each call set; 'peak_rss_error'
+        #     gives the reason for call sets where that failed, whose
+        #     peaks are then over the life of the process.
         #   callsetname -> '_'-joined call names
         #   pathinfo -> {'id': pathname,
         #                'exception': string,
         #                'diverge': '' | string,
         #                'tests': [testinfo],
-        #                'testerror'?: string}
+        #                'testerror'?: string,
+        #                'enum_time': seconds,
+        #                'enum_checks': int,
+        #                'term_sizes'?: {size: count}}
         #     Either 'exception' or 'diverge' will be present.
         #     'testerror' gives the error that terminated test
-        #     generation for this path (if any).
+        #     generation for this path (if any).  'enum_time' and
+        #     'enum_checks' give the time and solver queries spent
+        #     enumerating tests for the path.  'term_sizes' is a
+        #     histogram of the term sizes of the states the path
+        #     reached (with --term-sizes).
         #   pathname -> callsetname '_' pathid
         #   testinfo -> {'id': testname,
         #                'assignments': {expr: val},
@@ -254,6 +292,8 @@ class TestWriter(simtest.ExecutionMonitorBase):
         #                'idempotence_unknown': int}  # if non-zero
         #   testname -> pathname '_' testnum
         self.model_data = {'tests':{}}
+        if resume is not None:
+            self.model_data = resume['model_data']
 
         self.nmodel = self.nerror = self.ntesterrors = 0
 
@@ -267,20 +307,71 @@ class TestWriter(simtest.ExecutionMonitorBase):
                 " ".join(self.callset_names)
             print >> self.trace_file
 
-        self.model_data_callset = collections.OrderedDict()
-        self.model_data['tests']['_'.join(c.__name__ for c in callset)] \
-            = self.model_data_callset
+        # A resumed call set continues its existing entry
+        self.model_data_callset = self.model_data['tests'].setdefault(
+            '_'.join(c.__name__ for c in callset), collections.OrderedDict())
 
         self.nmodel = self.nerror = self.ntesterrors = 0
 
         if self.testgen:
             self.testgen.begin_call_set(callset)
 
+        if args.call_set_peak_rss:
+            error = reset_peak_rss()
+            if error is not None:
+                self.model_data.setdefault(
+                    'peak_rss_error', collections.OrderedDict())[
+                        '_'.join(self.callset_names)] = error
+
+    def get_checkpoint(self):
+        return {'nmodel': self.nmodel, 'nerror': self.nerror,
+                'ntesterrors': self.ntesterrors}
+
+    def restore_checkpoint(self, state):
+        self.nmodel, self.nerror, self.ntesterrors = \
+            state['nmodel'], state['nerror'], state['ntesterrors']
+
+    def output_state(self, callsets=None):
+        """Return the state of the output written so far.
+
+        Passing this as the resume argument of the constructor
+        continues the output from this point.  If callsets is not
+        None, the model data is limited to the call sets with these
+        names, and the test generator's state to what it added since
+        the last such call, for saving the output of a run piecemeal
+        (see Checkpointer).
+        """
+
+        model_data = self.model_data
+        if callsets is not None:
+            model_data = {key: collections.OrderedDict(
+                              (cs, entries[cs]) for cs in callsets
+                              if cs in entries)
+                          for key, entries in model_data.iteritems()}
+        state = {'model_data': model_data}
+        if self.trace_file:
+            self.trace_file.flush()
+            state['trace_file_size'] = self.trace_file.tell()
+        if self.testgen:
+            state['testgen'] = self.testgen.output_state(
+                new_only=callsets is not None)
+        return state
+
     def stop_call_set(self):
         if self.testgen and self.testgen.stop_call_set():
             return True
         return self.nmodel >= args.max_testcases
 
+    def __state_terms(self, testresult):
+        """Return the distinct Z3 terms of the states reached by the
+        calls in testresult."""
+        terms = {}
+        for pairs in testresult.op_states:
+            for _, state in pairs:
+                for term in simsym.flatten_compound(state._z3_value()):
+                    terms[term.get_id()] = term
+        return terms.values()
+
     def _testerror(self, reason, pathinfo):
         pathinfo['testerror'] = reason
         print 'Cannot enumerate, moving on..'
@@ -301,6 +392,9 @@ class TestWriter(simtest.ExecutionMonitorBase):
             return
 
         pathinfo['diverge'] = ', '.join(map(str, result.value.diverge))
+        if args.term_sizes:
+            pathinfo['term_sizes'] = z3util.term_size_histogram(
+                self.__state_terms(result.value))
 
         # Filter out non-commutative results
         if len(result.value.diverge):
@@ -337,7 +431,8 @@ class TestWriter(simtest.ExecutionMonitorBase):
         # contains a lot of trivial expressions like x==x for all
         # state variables x, and we don't care about these
         # uninterpreted constants.
-        e_vars = expr_vars(
+        self.free_vars.clear()
+        e_vars = self.free_vars.ids(
             simsym.simplify(
                 simsym.symand(
                     result.get_path_condition_list(
@@ -351,17 +446,21 @@ class TestWriter(simtest.ExecutionMonitorBase):
 
         self.npathmodel = 0
         self.last_assignments = None
+        enum = simsym.Enumerator(
+            e, incremental=(args.enumerate == 'incremental'))
+        enum_start = time.time()
         while not self.stop_call_set() and \
               self.npathmodel < args.max_tests_per_path:
-            # XXX Would it be faster to reuse the solver?
-            check = simsym.check(e)
+            e = enum.formula
+            check = enum.check()
             if check.is_sat and 'array-ext' in check.z3_model.sexpr():
                 # Work around some non-deterministic bug that causes
                 # Z3 to occasionally produce models containing
                 # 'array-ext' applications that break evaluation.
                 print 'Warning: Working around array-ext bug'
                 for i in range(10):
-                    check = simsym.check(e)
+                    enum.nchecks += 1
+                    check = simsym.check(e, need_model=True)
                     if not check.is_sat:
                         continue
                     if 'array-ext' not in check.z3_model.sexpr():
@@ -422,7 +521,7 @@ class TestWriter(simtest.ExecutionMonitorBase):
             same = IsomorphicMatch()
             for realm, rassigns in assignments.iteritems():
                 for aexpr, val in rassigns:
-                    aexpr_vars = expr_vars(aexpr)
+                    aexpr_vars = self.free_vars.ids(aexpr)
                     if not aexpr_vars.isdisjoint(e_vars):
                         same.add(realm, aexpr, val, result)
                     elif args.verbose_testgen:
@@ -440,7 +539,10 @@ class TestWriter(simtest.ExecutionMonitorBase):
             notsame = simsym.symnot(isocond)
             if args.verbose_testgen:
                 print 'Negation', self.nmodel, ':', notsame
-            e = simsym.symand([e, notsame])
+            enum.block(notsame)
+
+        pathinfo['enum_time'] = round(time.time() - enum_start, 3)
+        pathinfo['enum_checks'] = enum.nchecks
 
         if self.npathmodel == args.max_tests_per_path:
             print '  Max tests reached for path %s' % result.pathid
@@ -469,6 +571,8 @@ class TestWriter(simtest.ExecutionMonitorBase):
         return res
 
     def end_call_set(self):
+        self.model_data.setdefault('peak_rss', collections.OrderedDict())[
+            '_'.join(self.callset_names)] = peak_rss()
         super(TestWriter, self).end_call_set()
         if self.testgen:
             self.testgen.end_call_set()
@@ -480,6 +584,115 @@ class TestWriter(simtest.ExecutionMonitorBase):
         if self.model_file is not None:
             json.dump(self.model_data, file(self.model_file, 'w'), indent=2)
 
+class Checkpointer(object):
+    """Periodically save the progress of a run to a checkpoint file.
+
+    The checkpoint file is a log of JSON records, one per line.  The
+    first records the arguments that determine the call sets.  Each
+    save appends a record of the call sets completed since the last
+    save, the model data of those call sets and of the call set in
+    progress, the test generator's output since the last save, the
+    rest of the TestWriter's output state and that of the execution
+    graph writer, if any.  If a call set is in
+    progress, the record also holds its pending schedules and monitor
+    state.  So a save writes only what changed since the last one,
+    and load puts the records back together.
+    """
+
+    def __init__(self, path, interval, signature, test_writer,
+                 graph_writer=None, resume=None):
+        self.path, self.interval = path, interval
+        self.test_writer, self.graph_writer = test_writer, graph_writer
+        self.done = list(resume['done']) if resume else []
+        # Call sets completed since the last save
+        self.__finished = []
+        # Start a new log that holds what we resume from in one
+        # record.  Write it to a new file and rename it over the old
+        # one so a crash never loses the old log.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            print >> fp, json.dumps({'args': signature})
+            if resume:
+                print >> fp, json.dumps(collections.OrderedDict(
+                    (key, resume[key]) for key in
+                    ('done', 'current', 'writer', 'sched_graph')))
+        os.rename(tmp, self.path)
+        self.__fp = open(self.path, 'a')
+        self.__last = time.time()
+
+    @staticmethod
+    def load(path):
+        """Return the state saved in the checkpoint file path.
+
+        The state is a dict with the run's 'args', the call sets it
+        has completed ('done'), the progress of the call set in
+        progress ('current', or None), the TestWriter's output state
+        ('writer'), and the execution graph writer's ('sched_graph',
+        or None).  A record cut short by a crash is ignored.
+        """
+
+        state = None
+        with open(path) as fp:
+            for line in fp:
+                try:
+                    rec = json.loads(line,
+                                     object_pairs_hook=collections.OrderedDict)
+                except ValueError:
+                    break
+                if state is None:
+                    state = {'args': rec['args'], 'done': [], 'current': None,
+                             'writer': {'model_data': {'tests': {}}},
+                             'sched_graph': None}
+                    continue
+                state['done'].extend(rec['done'])
+                state['current'] = rec['current']
+                state['sched_graph'] = rec['sched_graph']
+                writer = state['writer']
+                for key, val in rec['writer'].iteritems():
+                    if key == 'testgen' and isinstance(val, dict) and \
+                       writer.get(key) is not None:
+                        # See testgen.TestGenerator.output_state
+                        for tkey, tval in val.iteritems():
+                            if isinstance(tval, list):
+                                writer[key][tkey].extend(tval)
+                            else:
+                                writer[key][tkey] = tval
+                    elif key != 'model_data':
+                        writer[key] = val
+                for key, entries in rec['writer']['model_data'].iteritems():
+                    writer['model_data'].setdefault(
+                        key, collections.OrderedDict()).update(entries)
+        return state
+
+    def call_set_progress(self, callset):
+        """Return a checkpoint function for simtest.test_callset."""
+        def checkpoint(get_state):
+            if time.time() - self.__last >= self.interval:
+                self.save({'callset': callset, 'state': get_state()})
+        return checkpoint
+
+    def end_call_set(self, callset):
+        """Record that callset is complete and save a checkpoint."""
+        self.done.append(callset)
+        self.__finished.append(callset)
+        self.save()
+
+    def save(self, current=None):
+        callsets = self.__finished + ([current['callset']] if current else [])
+        state = collections.OrderedDict([
+            ('done', self.__finished), ('current', current),
+            ('writer', self.test_writer.output_state(
+                ['_'.join(callset) for callset in callsets])),
+            ('sched_graph', self.graph_writer and
+                            self.graph_writer.output_state())])
+        # A crash can leave this record cut short, but not the
+        # records before it
+        print >> self.__fp, json.dumps(state)
+        self.__fp.flush()
+        os.fsync(self.__fp.fileno())
+        self.__finished = []
+        self.__last = time.time()
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--check-conds', action='store_true',
                     help='Check commutativity conditions for sat/unsat')
@@ -513,6 +726,91 @@ parser.add_argument('--diff-testgen', default=False, action='store_true',
                     help='Print variables that change during enumeration')
 parser.add_argument('--idempotent-projs', default=False, action='store_true',
                     help='Record idempotent projections in model file (slow)')
+parser.add_argument('--explore', choices=('replay', 'incremental'),
+                    default='replay',
+                    help='Path exploration engine: replay each path from the \
+                    root with a fresh solver, or reuse one solver across \
+                    paths.  incremental only saves solver work: each path \
+                    still re-runs the model code from the root \
+                    (default: %(default)s)')
+parser.add_argument('--verdict-cache', metavar='DIR',
+                    help='Cache solver query verdicts in DIR across runs.  \
+                    Models are not cached.  Branch checks, path checks \
+                    and test enumeration use the models of sat queries, \
+                    so only their unsat and unknown verdicts come from \
+                    the cache; their sat queries are always re-solved')
+parser.add_argument('--verdict-cache-min-time', metavar='SECS', type=float,
+                    default=0,
+                    help='Only cache queries that take at least SECS \
+                    seconds to solve (default: %(default)s)')
+parser.add_argument('--cex-cache', default=False, action='store_true',
+                    help='Answer branch checks by subsumption against \
+                    earlier checks on the same code path tree')
+parser.add_argument('--cex-cache-entries', type=int, default=64,
+                    metavar='N',
+                    help='Keep the N most recent sets per constraint in the \
+                    --cex-cache (default: %(default)s)')
+parser.add_argument('--provenance', choices=('lazy', 'full'), default='lazy',
+                    help='Record only the code location of each schedule \
+                    node, or capture full stack frame info for every node \
+                    (default: %(default)s)')
+parser.add_argument('--sched-graph', metavar='FILE',
+                    help='Write the execution graph of each call set to FILE \
+                    as DOT, or as JSON lines if FILE ends in .jsonl')
+parser.add_argument('--path-workers', type=int, default=0, metavar='N',
+                    help='Explore the code paths of each call set in N \
+                    worker processes')
+parser.add_argument('--strategy', default='dfs',
+                    choices=sorted(simsym.strategies),
+                    help='Order in which to explore code paths; matters when \
+                    --max-testcases cuts exploration short \
+                    (default: %(default)s)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Seed for --strategy random')
+parser.add_argument('--assume-policy', choices=('check', 'novel', 'defer'),
+                    default='check',
+                    help='Solver checks for new assumptions: check each for \
+                    redundancy and satisfiability, skip those identical to \
+                    an existing constraint, or defer satisfiability to the \
+                    next branch (default: %(default)s)')
+parser.add_argument('--simplify-cache-size', type=int, default=1024,
+                    metavar='N',
+                    help='Remember the simplified forms of the N most \
+                    recently simplified expressions; 0 disables the cache \
+                    (default: %(default)s)')
+parser.add_argument('--call-set-peak-rss', default=False,
+                    action='store_true',
+                    help='Reset the peak RSS at the start of each call set, \
+                    so model.out records per-call-set peaks (Linux only; \
+                    writes /proc/self/clear_refs)')
+parser.add_argument('--compact-threshold', type=int, default=0,
+                    metavar='N',
+                    help='Compact store and if-then-else chains in the \
+                    symbolic state once they grow past N links; 0 disables \
+                    compaction (default: %(default)s)')
+parser.add_argument('--term-sizes', default=False, action='store_true',
+                    help='Record a histogram of state term sizes for each \
+                    path in the model file')
+parser.add_argument('--enumerate', choices=('fresh', 'incremental'),
+                    default='fresh',
+                    help='Solve each test enumeration query from scratch, or \
+                    reuse one solver per code path; the two produce \
+                    different tests (default: %(default)s)')
+parser.add_argument('--slice-checks', action='store_true',
+                    help='Check test generation queries against only the \
+                    parts of the path condition that share variables with \
+                    the query, and enumerate tests by solving independent \
+                    parts separately; this produces different tests')
+parser.add_argument('--checkpoint', metavar='FILE',
+                    help='Periodically save progress to FILE')
+parser.add_argument('--checkpoint-interval', type=int, default=300,
+                    metavar='SECS',
+                    help='Seconds between checkpoints within a call set \
+                    (default: %(default)s)')
+parser.add_argument('--resume', default=False, action='store_true',
+                    help='Resume from the --checkpoint file, skipping \
+                    completed call sets and continuing a partially \
+                    explored one')
 parser.add_argument('module', metavar='MODULE', default='fs', action='store',
                     help='Module to test (e.g., models.fs)')
 
@@ -600,21 +898,116 @@ def main(spec_args):
     args = spec_args
 
     z3printer._PP.max_lines = float('inf')
+    simsym.options.explore = args.explore
+    if args.verdict_cache:
+        simsym.options.verdict_cache = verdictcache.VerdictCache(
+            args.verdict_cache, args.verdict_cache_min_time)
+    simsym.options.cex_cache = args.cex_cache
+    simsym.options.cex_cache_entries = args.cex_cache_entries
+    simsym.options.provenance = args.provenance
+    simsym.options.path_workers = args.path_workers
+    simsym.options.strategy = args.strategy
+    simsym.options.strategy_seed = args.seed
+    simsym.options.assume_policy = args.assume_policy
+    simsym.options.simplify_cache_size = args.simplify_cache_size
+    simsym.options.compact_threshold = args.compact_threshold
+    simsym.options.slice_checks = args.slice_checks
     m = importlib.import_module(args.module)
-    testgen = m.model_testgen if hasattr(m, 'model_testgen') else None
-    if testgen is None and args.test_file:
+    if args.path_workers:
+        # Fork the workers before anything uses Z3
+        simsym.start_path_workers()
+    model_testgen = getattr(m, 'model_testgen', None)
+    if model_testgen is None and args.test_file:
         parser.error("No test case generator for this module")
 
+    signature = {'module': args.module, 'functions': args.functions,
+                 'ncomb': args.ncomb}
+    checkpoint = None
+    if args.resume:
+        if not args.checkpoint:
+            parser.error("--resume requires --checkpoint")
+        try:
+            checkpoint = Checkpointer.load(args.checkpoint)
+        except IOError as e:
+            # Nothing to resume; start from the beginning
+            if e.errno != errno.ENOENT:
+                raise
+        if checkpoint is not None and checkpoint['args'] != signature:
+            parser.error("Checkpoint %s is for a different run" %
+                         args.checkpoint)
+
+    if args.sched_graph:
+        graph_state = checkpoint and checkpoint['sched_graph']
+        if graph_state is not None:
+            # Continue the graphs written up to the checkpoint
+            graph_file = open(args.sched_graph, 'r+')
+            graph_file.truncate(graph_state['size'])
+            graph_file.seek(0, 2)
+        elif checkpoint:
+            graph_file = open(args.sched_graph, 'a')
+        else:
+            graph_file = open(args.sched_graph, 'w')
+        simsym.options.sched_graph = graph.GraphWriter(
+            graph_file,
+            'jsonl' if args.sched_graph.endswith('.jsonl') else 'dot',
+            graph_state)
+
     test_writer = TestWriter(args.trace_file, args.model_file, args.test_file,
-                             testgen)
+                             model_testgen,
+                             checkpoint and checkpoint['writer'])
+    checkpointer = None
+    if args.checkpoint:
+        checkpointer = Checkpointer(
+            args.checkpoint, args.checkpoint_interval, signature, test_writer,
+            simsym.options.sched_graph, checkpoint)
 
     for callset in parse_functions(args.functions, args.ncomb, m):
+        if checkpoint and callset in checkpoint['done']:
+            continue
+        resume = None
+        if checkpoint and checkpoint['current'] and \
+           checkpoint['current']['callset'] == callset:
+            resume = checkpoint['current']['state']
         calls = [getattr(m.model_class, callname) for callname in callset]
         simtest.test_callset(m.model_class, calls, [test_writer],
                              check_conds=args.check_conds,
-                             print_conds=args.print_conds)
+                             print_conds=args.print_conds,
+                             resume=resume,
+                             checkpoint=checkpointer and
+                                 checkpointer.call_set_progress(callset))
+        if checkpointer:
+            checkpointer.end_call_set(callset)
 
     test_writer.finish()
+    if simsym.options.sched_graph:
+        simsym.options.sched_graph.end()
+
+    if args.verdict_cache:
+        print "Verdict cache: %d hits, %d misses (%d not recorded, " \
+            "%d needed a model)" % \
+            (simsym.stats["verdict_cache_hits"],
+             simsym.stats["verdict_cache_misses"],
+             simsym.stats["verdict_cache_uncached"],
+             simsym.stats["verdict_cache_model_misses"])
+    if args.cex_cache:
+        print "Counterexample cache: %d hits, %d misses" % \
+            (simsym.stats["cex_cache_hits"],
+             simsym.stats["cex_cache_misses"])
+    if args.assume_policy != 'check':
+        print "Assumption checks: %d made, %d skipped" % \
+            (simsym.stats["assume_checks"],
+             simsym.stats["assume_checks_skipped"])
+    if args.slice_checks:
+        print "Sliced checks: %d (%d conjuncts dropped, %d models reused)" % \
+            (simsym.stats["sliced_checks"], simsym.stats["sliced_conjuncts"],
+             simsym.stats["sliced_model_hits"])
+    if args.test_file or args.trace_file:
+        print "Simplify cache: %d hits, %d misses" % \
+            (simsym.stats["simplify_cache_hits"],
+             simsym.stats["simplify_cache_misses"])
+    if args.compact_threshold:
+        print "Compaction: %d chains, %d links dropped" % \
+            (simsym.stats["compactions"], simsym.stats["compacted_links"])
 
 if __name__ == "__main__":
     main(parser.parse_args())
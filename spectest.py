@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""Tests of spec.py's exploration options.
+
+Each test explores small functions with some option and checks that
+it finds the same code paths, and as many tests for each, as a plain
+run.  Z3 doesn't always pick the same models from run to run, so
+tests compare paths and test counts, not the models themselves.
+test_resume runs spec.py itself, since it needs a run that is killed
+part way through.
+
+Run this file directly to run all tests, or name the tests to run.
+"""
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import contextlib
+import StringIO
+import z3
+import simsym
+import graph
+import verdictcache
+
+SPEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spec.py')
+
+# The number of path workers the tests start
+NWORKERS = 2
+
+@contextlib.contextmanager
+def options(**kwargs):
+    """Set simsym options for the duration of a with block."""
+    old = {name: getattr(simsym.options, name) for name in kwargs}
+    for name, val in kwargs.iteritems():
+        setattr(simsym.options, name, val)
+    try:
+        yield
+    finally:
+        for name, val in old.iteritems():
+            setattr(simsym.options, name, val)
+
+def branches():
+    x, y, z = [simsym.SInt.var(name) for name in 'xyz']
+    simsym.assume(simsym.symand([0 <= x, x < 4, 0 <= y, y < 4,
+                                 0 <= z, z < 3]))
+    if x == y:
+        return 'same', [x, y], [z]
+    if x < y:
+        return 'less', [x, y], [z]
+    return 'more', [x, y], [z]
+
+def explore(fn, count=None):
+    """Return the values fn returns on each of its code paths, in order.
+
+    If count is given, fn must return a (name, block, free) tuple,
+    where block and free are lists of SInts.  Each path's value is
+    then name and the number of distinct assignments of block's SInts
+    if count is "block", or of all the SInts if it is "all".
+    """
+
+    res = []
+    for r in simsym.symbolic_apply(fn):
+        if count is None:
+            res.append(r.value)
+            continue
+        name, block, free = r.value
+        if count == 'all':
+            block = block + free
+        enum = simsym.Enumerator(r.path_condition)
+        ntests = 0
+        while True:
+            check = enum.check()
+            if not check.is_sat:
+                break
+            vals = [check.z3_model.evaluate(simsym.unwrap(v), True)
+                    for v in block]
+            enum.block(simsym.symnot(simsym.symand(
+                [v == val.as_long() for v, val in zip(block, vals)])))
+            ntests += 1
+        res.append((name, ntests))
+    return res
+
+def test_verdict_cache():
+    # A warm cache answers every query whose model isn't needed, and
+    # the cached verdicts don't change the paths or the tests
+    plain = explore(branches, 'all')
+    assert plain == [('same', 12), ('less', 18), ('more', 18)], plain
+    cachedir = tempfile.mkdtemp(prefix='spectest')
+    try:
+        for name in ('cold', 'warm'):
+            start = simsym.stats.copy()
+            cache = verdictcache.VerdictCache(cachedir)
+            with options(verdict_cache=cache):
+                cached = explore(branches, 'all')
+            assert cached == plain, (name, cached)
+            stats = simsym.stats - start
+        assert stats['verdict_cache_hits'] > 0, stats
+        assert stats['verdict_cache_uncached'] == 0, stats
+        # Every miss of the warm run is a sat check whose model is
+        # needed, since the cache keeps verdicts only
+        assert stats['verdict_cache_misses'] == \
+            stats['verdict_cache_model_misses'], stats
+    finally:
+        shutil.rmtree(cachedir)
+
+def test_slice_checks():
+    # Sliced enumeration finds as many tests.  Blocking x and y
+    # leaves z's group alone, so its model is reused.
+    plain = explore(branches, 'block')
+    assert plain == [('same', 4), ('less', 6), ('more', 6)], plain
+    start = simsym.stats.copy()
+    with options(slice_checks=True):
+        sliced = explore(branches, 'block')
+    assert sliced == plain, sliced
+    stats = simsym.stats - start
+    assert stats['sliced_model_hits'] > 0, stats
+
+    # check_sliced only checks the conjuncts an extension shares
+    # variables with, and gives the same verdicts
+    plain, = [r.value for r in simsym.symbolic_apply(sliced_checks)]
+    with options(slice_checks=True):
+        sliced, = [r.value for r in simsym.symbolic_apply(sliced_checks)]
+    assert plain == [(True, 0), (False, 0), (False, 0)], plain
+    assert sliced == [(True, 2), (False, 2), (False, 0)], sliced
+
+def sliced_checks():
+    """Return the verdict of check_sliced for a few extensions of a
+    base and the number of conjuncts it dropped for each."""
+    x, y = simsym.SInt.var('x'), simsym.SInt.var('y')
+    base = [0 <= x, x < 4, 0 <= y, y < 4]
+    res = []
+    for extra in ([y == 2], [y == 5], [x + y == 7]):
+        start = simsym.stats.copy()
+        check = simsym.check_sliced(base, extra)
+        res.append((check.is_sat,
+                    (simsym.stats - start)['sliced_conjuncts']))
+    return res
+
+def test_sched_graph():
+    # Path workers must produce the same execution graph as a serial
+    # run, even though the calling process re-creates each path's
+    # SchedNodes
+    graphs = []
+    for workers in (0, NWORKERS):
+        out = StringIO.StringIO()
+        writer = graph.GraphWriter(out, 'jsonl')
+        with options(sched_graph=writer, path_workers=workers):
+            explore(branches)
+        writer.end()
+        graphs.append(out.getvalue())
+    assert graphs[0] and graphs[0] == graphs[1], graphs
+
+def defer_unsat():
+    x = simsym.SInt.var('x')
+    if x > 10:
+        return 'big'
+    simsym.assume(x > 5)
+    simsym.assume(x < 3)
+    if x == 4:
+        return 'four'
+    return 'other'
+
+def test_defer_unsat():
+    # Path workers must report the unsatisfiable path like a serial
+    # run, rather than replaying it as satisfiable
+    for workers in (0, NWORKERS):
+        res = []
+        with options(assume_policy='defer', path_workers=workers):
+            try:
+                for r in simsym.symbolic_apply(defer_unsat):
+                    res.append(r.value)
+            except simsym.UnsatisfiablePath as e:
+                res.append(str(e.node.expr))
+        assert res == ['big', 'x < 3'], (workers, res)
+
+def replay_implied():
+    x = simsym.SInt.var('x')
+    simsym.assume(x > 0)
+    simsym.assume(x > -1)
+    if x > 5:
+        simsym.assume(x > 2)
+        return 'big'
+    simsym.assume(x < 10)
+    return 'small'
+
+def test_replay_implied():
+    # The calling process re-runs path workers' paths, including
+    # their implied assumptions, without consulting the solver
+    checks = [0]
+    solver_check = z3.Solver.check
+    def counting_check(self, *args):
+        checks[0] += 1
+        return solver_check(self, *args)
+    res = []
+    # Only the checks of this process are counted, not the workers'
+    z3.Solver.check = counting_check
+    try:
+        for workers in (0, NWORKERS):
+            checks[0] = 0
+            with options(path_workers=workers):
+                res.append((explore(replay_implied), checks[0]))
+    finally:
+        z3.Solver.check = solver_check
+    (serial, serial_checks), (parallel, parallel_checks) = res
+    assert sorted(serial) == sorted(parallel) == ['big', 'small'], res
+    assert serial_checks > 0 and parallel_checks == 0, res
+
+# Runs spec.py, but exits with status 3 right after the Nth
+# checkpoint saved in the middle of a call set, like a killed run
+CRASH_AFTER_SAVES = """
+import sys
+sys.path.insert(0, %r)
+saves = [0]
+save = spec.Checkpointer.save
+def crashing_save(self, current=None):
+    save(self, current)
+    if current is not None:
+        saves[0] += 1
+        if saves[0] == %d:
+            sys.exit(3)
+spec.Checkpointer.save = crashing_save
+spec.main(spec.parser.parse_args())
+"""
+
+def run_spec(outdir, args, crash_after=None):
+    """Run spec.py on models.rename with args, and return a map from
+    (callset, pathid) to a summary of each path.
+
+    With crash_after=N, the run stops after N checkpoints saved in
+    the middle of a call set.
+    """
+
+    model_file = os.path.join(outdir, 'model.out')
+    if crash_after is None:
+        cmd = [sys.executable, SPEC]
+    else:
+        cmd = [sys.executable, '-c', CRASH_AFTER_SAVES %
+               (os.path.dirname(SPEC), crash_after)]
+    cmd += ['models.rename', '-m', model_file] + args
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        if e.returncode != 3 or crash_after is None:
+            raise
+        return None
+    with open(model_file) as fp:
+        tests = json.load(fp)['tests']
+    return {(cs, pid): (p.get('diverge'), p.get('exception'),
+                        len(p.get('tests', [])))
+            for cs, cspaths in tests.iteritems()
+            for pid, p in cspaths.iteritems()}
+
+def test_resume():
+    # Resuming in the middle of a call set queues the pending schedule
+    # prefixes before any of them is replayed.  Every strategy must
+    # explore the rest of the call set from there.
+    outdir = tempfile.mkdtemp(prefix='spectest')
+    try:
+        ckpt = os.path.join(outdir, 'ck')
+        ckpt2 = os.path.join(outdir, 'ck2')
+        graph_file = os.path.join(outdir, 'graph.jsonl')
+        plain = run_spec(outdir, [])
+        for strategy in ('dfs', 'bfs', 'random', 'shortest',
+                         'commutative-first'):
+            args = ['--strategy', strategy, '--checkpoint', ckpt,
+                    '--checkpoint-interval', '0']
+            run_spec(outdir, args, crash_after=3)
+            with open(ckpt) as fp:
+                # The last record of the checkpoint log is the latest
+                pending = json.loads(fp.readlines()[-1])['current'][
+                    'state']['pending']
+            assert len(pending) >= 2, (strategy, pending)
+            resumed = run_spec(outdir, ['--resume'] + args)
+            assert resumed == plain, strategy
+
+        # A resumed run continues the execution graph file, numbering
+        # its graphs after the ones written before the crash
+        args = ['--checkpoint', ckpt2, '--checkpoint-interval', '0',
+                '--sched-graph', graph_file]
+        def graph_numbers():
+            with open(graph_file) as fp:
+                return [rec['graph'] for rec in map(json.loads, fp)
+                        if 'graph' in rec]
+        run_spec(outdir, args, crash_after=3)
+        crashed = graph_numbers()
+        run_spec(outdir, ['--resume'] + args)
+        resumed = graph_numbers()
+        assert crashed and resumed[:len(crashed)] == crashed, \
+            (crashed, resumed)
+        assert resumed == range(len(resumed)), resumed
+    finally:
+        shutil.rmtree(outdir)
+
+def main(names):
+    # Fork the path workers before any test uses Z3
+    with options(path_workers=NWORKERS):
+        simsym.start_path_workers()
+    tests = sorted(name for name in globals() if name.startswith('test_'))
+    for name in names or tests:
+        print name
+        globals()[name]()
+    print 'OK'
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
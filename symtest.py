@@ -2,6 +2,7 @@
 
 from simsym import *
 from symtypes import *
+import z3util
 
 def test():
     # Maps
@@ -103,4 +104,11 @@ def test():
     del d1[0], d2[0]
     assert d1 == d2
 
+    # HashableAsts of mutable values keep their key after writes
+    x = tstruct(a=SInt).var("s4", a=1)
+    h = z3util.HashableAst(x)
+    s = set([h])
+    x.a = 2
+    assert h in s
+
 list(symbolic_apply(test))
@@ -17,15 +17,33 @@ class TestGenerator(simtest.ExecutionMonitorBase):
     call the superclass method.
     """
 
-    def __init__(self, test_file_name):
+    def __init__(self, test_file_name, resume=None):
         """Initialize the test generator.
 
         test_file_name is the file name for test output.  The subclass
         may derive other file names from this.
+
+        If resume is not None, it is a value returned by output_state
+        in an earlier, interrupted run, and the generator should
+        continue the output it describes rather than start over.
         """
         super(TestGenerator, self).__init__()
         self.__result = self.__model = None
 
+    def output_state(self, new_only=False):
+        """Return the state of the output generated so far.
+
+        This is called between code paths and must return a
+        JSON-serializable value to be passed as the resume argument
+        of the constructor.  The default implementation returns None.
+
+        If new_only is True, the lists in a returned dict may hold
+        only the items added since the last such call.  Joining the
+        lists of successive states, and taking the last value of
+        everything else, gives the whole state (see spec.Checkpointer).
+        """
+        return None
+
     def get_result(self, callno):
         """Return the result for the callno'th call.
 
@@ -0,0 +1,180 @@
+"""Persistent cache of Z3 satisfiability verdicts.
+
+A VerdictCache maps the canonical SMT-LIB text of a query to the
+verdict of checking it (sat, unsat or unknown, but not a model), so
+that re-running spec.py over an unchanged (or slightly changed) model
+doesn't re-solve the same formulas.  Set simsym.options.verdict_cache
+to a VerdictCache to enable it.
+"""
+
+import os
+import errno
+import json
+import hashlib
+import tempfile
+import collections
+import atexit
+import z3
+
+class VerdictCache(object):
+    """A directory of Z3 check verdicts keyed by query.
+
+    Each entry is a small JSON file named by the SHA-1 of the query's
+    SMT-LIB serialization (including declarations) and the solver
+    configuration: the Z3 version and the global parameters in
+    config_params, such as the timeout, that can change a verdict.
+    Entries are written to a temporary file and renamed into place, so
+    concurrent processes (such as par-spec workers) can safely share
+    one cache directory.
+
+    Sat entries record only the verdict; Z3 has no way to load a model
+    back in, so callers that need a model must re-solve.
+
+    Only queries that took at least min_time seconds to solve are
+    recorded.  By default every query is.  Skipping cheap queries
+    keeps the cache small, but they then miss on every run.
+
+    Queries are mostly path constraints that grow one conjunct at a
+    time, so the key of a query is built from digests of its
+    individual formulas (and of the conjuncts of a conjunction).
+    These are memoized by Z3 AST id in an LRU cache of
+    digest_cache_size entries, which holds on to the ASTs so their ids
+    aren't reused.
+    """
+
+    # Global Z3 parameters that can change the verdict of a query
+    config_params = ("timeout", "smt.auto_config", "smt.mbqi",
+                     "smt.random_seed", "smt.relevancy")
+
+    def __init__(self, path, min_time=0, digest_cache_size=65536):
+        self.path = path
+        self.min_time = min_time
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.__digests = collections.OrderedDict()
+        self.__digest_cache_size = digest_cache_size
+        # Release the cached Z3 objects while the z3 module is still
+        # intact
+        atexit.register(self.clear_digests)
+
+    def clear_digests(self):
+        """Forget the memoized formula digests and their ASTs."""
+        self.__digests.clear()
+
+    def digest(self, formula):
+        """Return a digest of Z3 formula's SMT-LIB serialization.
+
+        A conjunction's digest is built from the digests of its
+        conjuncts, so extending a conjunction only serializes the new
+        conjuncts.
+        """
+
+        if not z3.is_ast(formula):
+            formula = z3.BoolVal(formula)
+        digests = self.__digests
+        todo = [formula]
+        while todo:
+            f = todo[-1]
+            ent = digests.pop(f.get_id(), None)
+            if ent is not None:
+                digests[f.get_id()] = ent
+                todo.pop()
+                continue
+            if z3.is_and(f):
+                children = f.children()
+                pending = [c for c in children if c.get_id() not in digests]
+                if pending:
+                    todo.extend(pending)
+                    continue
+                h = hashlib.sha1("and")
+                for c in children:
+                    h.update(digests[c.get_id()][1])
+            else:
+                # Take the declarations from Z3's benchmark printer,
+                # but not the formula: it names shared subterms by AST
+                # id, and only if they are shared outside the formula.
+                bench = z3.Z3_benchmark_to_smtlib_string(
+                    f.ctx_ref(), "", "", "", "", 0, (z3.Ast * 0)(),
+                    f.as_ast())
+                h = hashlib.sha1(bench[:bench.find("(assert")])
+                h.update(f.sexpr())
+            todo.pop()
+            digests[f.get_id()] = (f, h.digest())
+        res = digests[formula.get_id()][1]
+        while len(digests) > self.__digest_cache_size:
+            digests.popitem(last=False)
+        return res
+
+    def key(self, formulas, kind=""):
+        """Return the cache key for the conjunction of formulas.
+
+        kind distinguishes queries over the same formulas that are
+        posed to the solver differently, and hence may differ in
+        whether they come back unknown.  Any element of formulas may
+        instead be the digest of the formula.
+        """
+
+        h = hashlib.sha1(self.__config())
+        h.update(kind + "\n")
+        for f in formulas:
+            h.update(f if isinstance(f, str) else self.digest(f))
+        return h.hexdigest()
+
+    def __config(self):
+        """Return the solver configuration part of keys.
+
+        The parameters are read for every key, since they can be
+        changed at any time.
+        """
+
+        config = ["z3 %s" % z3.get_version_string()]
+        for param in self.config_params:
+            try:
+                config.append("%s=%s" % (param, z3.get_param(param)))
+            except z3.Z3Exception:
+                # Not a parameter of this version of Z3
+                pass
+        return "\n".join(config) + "\n"
+
+    def __file(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Return the cached (result, reason) for key, or None.
+
+        result is a Z3 CheckSatResult and reason is the solver's
+        reason for an unknown result.
+        """
+
+        try:
+            with open(self.__file(key)) as fp:
+                ent = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        result = {"sat": z3.sat, "unsat": z3.unsat,
+                  "unknown": z3.unknown}.get(ent.get("result"))
+        if result is None:
+            return None
+        return result, ent.get("reason")
+
+    def put(self, key, result, reason=None):
+        """Record the result of the query with the given key."""
+
+        fname = self.__file(key)
+        dname = os.path.dirname(fname)
+        try:
+            os.mkdir(dname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmpname = tempfile.mkstemp(dir=dname, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump({"result": str(result), "reason": reason}, fp)
+            os.rename(tmpname, fname)
+        except:
+            os.unlink(tmpname)
+            raise
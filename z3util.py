@@ -31,6 +31,49 @@ def predicates(expr):
 
     return res
 
+def ast_key(val):
+    """Return a hashable key for the structure of a compound Z3 value.
+
+    Z3 hash-conses ASTs, so two ASTs in the same context are
+    structurally equal exactly when they have the same id.  The key
+    is only meaningful while the ASTs in val are alive.
+    """
+
+    if isinstance(val, dict):
+        return tuple(sorted((k, ast_key(v)) for k, v in val.iteritems()))
+    if isinstance(val, z3.AstRef):
+        return val.get_id()
+    return ("value", val)
+
+def term_size(expr):
+    """Return the number of distinct subterms of Z3 expression expr.
+
+    This counts the term as a DAG, so shared subterms count once.
+    """
+
+    seen = set()
+    todo = [expr]
+    while todo:
+        e = todo.pop()
+        if e.get_id() in seen:
+            continue
+        seen.add(e.get_id())
+        todo.extend(e.children())
+    return len(seen)
+
+def term_size_histogram(exprs):
+    """Return a histogram of the term sizes of exprs.
+
+    The result is an OrderedDict mapping n to the number of exprs
+    whose term_size is at least n and less than 2*n, for powers of two
+    n, in increasing order of n.
+    """
+
+    hist = collections.Counter()
+    for expr in exprs:
+        hist[1 << (term_size(expr).bit_length() - 1)] += 1
+    return collections.OrderedDict(sorted(hist.items()))
+
 class HashableAst(object):
     """Wrapper for simsym/Z3 ASTs for Python hashing and equality.
 
@@ -40,14 +83,24 @@ class HashableAst(object):
     is good for building expressions, but makes ASTs unsuitable for
     direct use in dictionaries and sets.  Z3 ASTs additionally use
     default object hashing, making them further unsuitable.
+
+    The structure is captured once, by ast_key, so hashing and
+    comparing HashableAsts doesn't call into Z3.  The key holds AST
+    ids, so a HashableAst keeps the value it was taken from alive.
+    For a mutable simsym value, the key is that of its value when the
+    HashableAst was created; later writes to the value don't change
+    it, so a HashableAst keeps its place in sets and dicts.
     """
 
     def __init__(self, ast):
         self.ast = ast
-        if z3.is_ast(ast):
+        if isinstance(ast, z3.AstRef):
             self.__type = "z3"
+            self.__key = ast.get_id()
         elif isinstance(ast, simsym.Symbolic):
             self.__type = "simsym"
+            self.__val = ast._z3_value()
+            self.__key = ast_key(self.__val)
         else:
             self.__type = "value"
 
@@ -63,13 +116,13 @@ class HashableAst(object):
             # to compare Python values with things like z3.IntNumRef.
             raise TypeError("Cannot compare different HashableAst types")
         if self.__type == "z3" or self.__type == "simsym":
-            return self.ast.eq(o.ast)
+            return self.__key == o.__key
         else:
             return self.ast == o.ast
 
     def __hash__(self):
-        if self.__type == "z3":
-            return self.ast.hash()
+        if self.__type == "z3" or self.__type == "simsym":
+            return hash(self.__key)
         return hash(self.ast)
 
 class AstSet(object):